@@ -6,7 +6,12 @@ Author: Ian Rees, 2014.
 import argparse
 import csv
 import os
+import bisect
 import inspect
+import itertools
+import re
+
+import cityism.instrument
 
 INTERESTING = ['B01001', 'B25034']
 
@@ -55,6 +60,8 @@ class ACSMeta(object):
     # Class attr
     ACSTABLES = {}
     LOADED = False
+    INDEX = {}
+    TOKENS = []
 
     # Properties
     acstable = property(lambda self:self.data['acstable'])
@@ -127,6 +134,36 @@ class ACSMeta(object):
             return cls.ACSTABLES[acstable]
         raise KeyError("Unknown ACS table: %s"%acstable)
 
+    @classmethod
+    def buildindex(cls):
+        """Build an inverted index of table id, title and subject words."""
+        cls.INDEX = {}
+        for key, table in cls.ACSTABLES.items():
+            for token in set(cls._tokens(' '.join([key, table.title, table.subject or '']))):
+                cls.INDEX.setdefault(token, set()).add(key)
+        cls.TOKENS = sorted(cls.INDEX.keys())
+
+    @classmethod
+    def search(cls, query):
+        """Search tables by keyword, e.g. "year structure built". Every
+        word must match the prefix of a word in the table id, title or
+        subject. Return matching ACSMeta tables, sorted by table id."""
+        if not cls.TOKENS:
+            cls.buildindex()
+        keys = None
+        for term in cls._tokens(query):
+            found = set()
+            i = bisect.bisect_left(cls.TOKENS, term)
+            while i < len(cls.TOKENS) and cls.TOKENS[i].startswith(term):
+                found |= cls.INDEX[cls.TOKENS[i]]
+                i += 1
+            keys = found if keys is None else keys & found
+        return [cls.ACSTABLES[k] for k in sorted(keys or [])]
+
+    @staticmethod
+    def _tokens(text):
+        return re.findall('[a-z0-9]+', text.lower())
+
     def addchild(self, child):
         """Add a child ACSMeta. For instance, "B25034" has 10 children
         corresponding to the 10 data columns."""
@@ -157,11 +194,13 @@ class ACSMeta(object):
         # Load ACS data.        
         filename = 'e%04d%01d%s%04d%03d.txt'%(year, span, state, self.seqno, 0)
         print "Loading ACS data: %s"%filename
-        with open(filename) as f:
-            reader = csv.reader(f)
-            for row in reader:                
-                tract = self.parse(row, geom=geom)
-                ret.append(tract)
+        with cityism.instrument.stage('acs.read', acstable=self.acstable, state=state, year=year) as s:
+            with open(filename) as f:
+                reader = csv.reader(f)
+                for row in reader:                
+                    tract = self.parse(row, geom=geom)
+                    ret.append(tract)
+            s.add(rows=len(ret), bytes=os.path.getsize(filename))
         return ret
 
     def parse(self, row, geom=None):
@@ -212,12 +251,14 @@ class ACSGeometry(object):
         """Load the geometry file."""
         geofile = 'g%04d%01d%s.csv'%(self.year, self.span, self.state)
         print "Loading ACS Geometry: %s"%geofile        
-        with open(geofile) as f:
-            reader = csv.reader(f)
-            for row in reader:
-                logrecno = row[4]
-                geoid = row[48]
-                self.geoids[logrecno] = geoid
+        with cityism.instrument.stage('acs.geometry', state=self.state, year=self.year) as s:
+            with open(geofile) as f:
+                reader = csv.reader(f)
+                for row in reader:
+                    logrecno = row[4]
+                    geoid = row[48]
+                    self.geoids[logrecno] = geoid
+            s.add(rows=len(self.geoids), bytes=os.path.getsize(geofile))
     
     def getgeoid(self, logrecno):
         """Return a Census tract ID from a ACS logrecno."""
@@ -229,16 +270,28 @@ class ACSGeometry(object):
 class ACSShape(object):
     """Parse TIGER Shapefiles provided by ACS."""
     
-    def __init__(self, shapedir):
+    def __init__(self, shapedir, encoding='latin1'):
+        """TIGER DBF text fields are Latin-1."""
         self.shapedir = shapedir
+        self.encoding = encoding
         self.shapes = {}
-    
+
+    def fields(self):
+        """Return the shapefile field definitions: (name, type, size, decimals)."""
+        import shapefile
+        return [tuple(i) for i in shapefile.Reader(self.shapedir, encoding=self.encoding).fields[1:]]
+
+    def iterrecords(self):
+        """Iterate over (record, shape) pairs, reading one at a time."""
+        import shapefile
+        sf = shapefile.Reader(self.shapedir, encoding=self.encoding)
+        for rec, shape in itertools.izip(sf.iterRecords(), sf.iterShapes()):
+            yield rec, shape
+
     def load(self):
         """Load the records and shapes from ACS Shapefiles."""
-        import shapefile
         print "Loading Census Shapes: %s"%self.shapedir
-        sf = shapefile.Reader(self.shapedir)
-        for rec, shape in zip(sf.records(), sf.shapes()):
+        for rec, shape in self.iterrecords():
             geoid = rec[3]
             self.shapes[geoid] = (rec, shape)
 
@@ -307,4 +360,11 @@ def _load_acsfips(acsfipspath=None):
 _load_acsmeta()    
 _load_acsfips()
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("query", help="Search table titles and subjects, e.g. year structure built", nargs='+')
+    args = parser.parse_args()
+    for table in ACSMeta.search(' '.join(args.query)):
+        print "%s\t%s\t%s"%(table.acstable, table.subject, table.title)
+
 
@@ -0,0 +1,401 @@
+"""Benchmarks for parsing, loading, radial queries and classification.
+
+Synthetic ACS sequence and geography files, LODES files, tract polygons and
+life expectancy data are generated in a temporary directory. Database loads
+write to a stand-in cursor that consumes the SQL and COPY data without a
+server, so they measure everything up to the wire. The radial query needs
+a real PostGIS database and only runs with --db.
+
+Each benchmark runs in its own process. Results are reported as JSON: best
+and median wall time, throughput, and peak resident memory.
+
+  python bench.py --scale 10000 --repeat 3 > bench.json
+  python bench.py --db --lon -121.89 --lat 37.33 --only radial
+
+"""
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = []
+
+class Skip(Exception):
+    """Raised by a benchmark's setup when it cannot run here."""
+
+def benchmark(name):
+    """Register a benchmark. The function receives (workdir, args), does
+    its setup, and returns a callable that runs one timed iteration and
+    returns the number of items processed."""
+    def wrap(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return wrap
+
+class StandInCursor(object):
+    """Stand-in for a psycopg2 cursor: consumes statements and COPY data."""
+
+    def __init__(self):
+        self.statements = 0
+        self.bytes = 0
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.statements += 1
+
+    def copy_from(self, f, table, sep='\t', null='\\N', columns=None):
+        self._consume(f)
+
+    def copy_expert(self, query, f):
+        self._consume(f)
+
+    def _consume(self, f):
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            self.bytes += len(data)
+
+class StandInConnection(object):
+    """Stand-in for a config.Connection, handing out StandInCursors."""
+
+    def __init__(self):
+        self.prepared = set()
+
+    def cursor(self):
+        return StandInCursor()
+
+##### Synthetic data #####
+
+def make_geoids(n, state='06'):
+    return ['%s%03d%06d'%(state, 1 + (i // 1000) * 2, 100 + i % 1000 * 100) for i in range(n)]
+
+def make_acs(workdir, n, acstable, year=2012, span=5, state='ca'):
+    """Write ACS geography and sequence files for one table."""
+    geoids = make_geoids(n)
+    with open(os.path.join(workdir, 'g%04d%01d%s.csv'%(year, span, state)), 'wb') as f:
+        writer = csv.writer(f)
+        for i, geoid in enumerate(geoids):
+            row = [''] * 49
+            row[4] = '%07d'%(i+1)
+            row[48] = '14000US%s'%geoid
+            writer.writerow(row)
+    ncols = acstable.seqstart + len(acstable.children)
+    with open(os.path.join(workdir, 'e%04d%01d%s%04d%03d.txt'%(year, span, state, acstable.seqno, 0)), 'wb') as f:
+        writer = csv.writer(f)
+        for i in range(n):
+            row = ['ACSSF', '2012e5', state, '000', '%04d'%acstable.seqno, '%07d'%(i+1)]
+            row += [str(random.randint(0, 5000)) for j in range(ncols - len(row))]
+            writer.writerow(row)
+
+def make_lodes(workdir, n, blocks=20, state='ca'):
+    """Write a WAC file with blocks per tract."""
+    filename = os.path.join(workdir, '%s_wac_S000_JT00_2011.csv'%state)
+    columns = ['C000'] + ['CA%02d'%i for i in range(1, 4)] + ['CE%02d'%i for i in range(1, 4)]
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['w_geocode'] + columns + ['createdate'])
+        for geoid in make_geoids(n):
+            for block in range(blocks):
+                writer.writerow([geoid + '%04d'%block] + [random.randint(0, 50) for i in columns] + ['20130101'])
+    return filename
+
+def make_lifeexpectancy(workdir, counties=3000, years=range(1987, 2010)):
+    filename = os.path.join(workdir, 'le.csv')
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['fips', 'state', 'county', 'year', 'male', 'female'])
+        for county in range(counties):
+            for year in years:
+                writer.writerow([6000 + county, 'CA', 'County', year, random.uniform(65, 80), random.uniform(70, 85)])
+    return filename
+
+def make_polygon(lon, lat, radius, vertices):
+    """A jittered circle, clockwise as in shapefiles."""
+    ring = []
+    for i in range(vertices):
+        angle = -2 * math.pi * i / vertices
+        r = radius * random.uniform(0.8, 1.0)
+        ring.append([lon + r * math.cos(angle), lat + r * math.sin(angle)])
+    ring.append(ring[0])
+    return ring
+
+def make_shapes(workdir, n, vertices=200):
+    """Write a tract shapefile with n polygons."""
+    import shapefile
+    filename = os.path.join(workdir, 'tracts')
+    w = shapefile.Writer(filename, shapeType=shapefile.POLYGON)
+    for field in ['STATEFP', 'COUNTYFP', 'TRACTCE', 'GEOID', 'NAME']:
+        w.field(field, 'C', 11)
+    w.field('ALAND', 'N', 14, 0)
+    w.field('INTPTLAT', 'C', 11)
+    w.field('INTPTLON', 'C', 12)
+    side = int(math.ceil(math.sqrt(n)))
+    for i, geoid in enumerate(make_geoids(n)):
+        lon, lat = -122.5 + (i % side) * 0.01, 37.0 + (i // side) * 0.01
+        w.poly([make_polygon(lon, lat, 0.005, vertices)])
+        w.record(geoid[:2], geoid[2:5], geoid[5:], geoid, geoid[5:], random.randint(10**5, 10**7), str(lat), str(lon))
+    w.close()
+    return filename
+
+##### Benchmarks #####
+
+@benchmark('acs.ACSGeometry.load')
+def bench_acsgeometry(workdir, args):
+    import cityism.acs
+    acstable = cityism.acs.ACSMeta.get('B25034')
+    make_acs(workdir, args.scale, acstable)
+    def run():
+        geom = cityism.acs.ACSGeometry(2012, 5, 'ca')
+        geom.load()
+        return len(geom.geoids)
+    return run
+
+@benchmark('acs.ACSMeta.read')
+def bench_acsmeta_read(workdir, args):
+    import cityism.acs
+    acstable = cityism.acs.ACSMeta.get('B25034')
+    make_acs(workdir, args.scale, acstable)
+    def run():
+        return len(acstable.read(year=2012, span=5, state='ca'))
+    return run
+
+@benchmark('acs.ACSMeta.parse')
+def bench_acsmeta_parse(workdir, args):
+    import cityism.acs
+    acstable = cityism.acs.ACSMeta.get('B25034')
+    make_acs(workdir, args.scale, acstable)
+    with open('e%04d%01d%s%04d%03d.txt'%(2012, 5, 'ca', acstable.seqno, 0)) as f:
+        rows = list(csv.reader(f))
+    def run():
+        for row in rows:
+            acstable.parse(row)
+        return len(rows)
+    return run
+
+@benchmark('acs.ACSMeta.search')
+def bench_acsmeta_search(workdir, args):
+    import cityism.acs
+    queries = ['year structure built', 'travel time', 'median gross rent', 'b2503', 'income']
+    def run():
+        cityism.acs.ACSMeta.buildindex()
+        for query in queries * 20:
+            cityism.acs.ACSMeta.search(query)
+        return len(queries) * 20
+    return run
+
+@benchmark('load_acs.insert')
+def bench_load_acs(workdir, args):
+    import cityism.acs
+    import cityism.load.load_acs as load_acs
+    acstable = cityism.acs.ACSMeta.get('B25034')
+    make_acs(workdir, args.scale, acstable)
+    tracts = acstable.read(year=2012, span=5, state='ca')
+    children = acstable.getchildren()
+    def run():
+        conn = StandInConnection()
+        cursor = conn.cursor()
+        load_acs.create_table(cursor, acstable, children)
+        return load_acs.insert_tracts(conn, cursor, acstable, children, tracts)
+    return run
+
+@benchmark('load_acsmeta.copy')
+def bench_load_acsmeta(workdir, args):
+    import StringIO
+    import cityism.config
+    import cityism.load.load_acsmeta
+    def run():
+        buf = StringIO.StringIO()
+        count = 0
+        for row in cityism.load.load_acsmeta.iterrows():
+            buf.write('\t'.join(cityism.config.copy_value(i) for i in row))
+            buf.write('\n')
+            count += 1
+        buf.seek(0)
+        StandInCursor().copy_from(buf, 'acsmeta')
+        return count
+    return run
+
+@benchmark('load_lodes.aggregate_copy')
+def bench_load_lodes(workdir, args):
+    import cityism.load.load_lodes as load_lodes
+    filename = make_lodes(workdir, args.scale)
+    headers = load_lodes.read_header(filename, 'wac')
+    def run():
+        keys, values = load_lodes.aggregate(filename, 'wac', level='tract')
+        load_lodes.copy_rows(StandInCursor(), 'lodes_wac', 'wac', headers, keys, values, level='tract')
+        return int(values.shape[0])
+    return run
+
+@benchmark('load_lifeexptancy.parse_copy')
+def bench_load_lifeexpectancy(workdir, args):
+    import cityism.load.load_lifeexptancy as load_le
+    filename = make_lifeexpectancy(workdir)
+    def run():
+        data = load_le.parse(filename)
+        load_le.copy_years(StandInCursor(), data)
+        return len(data)
+    return run
+
+@benchmark('load_tiger.copy_binary')
+def bench_load_tiger(workdir, args):
+    import cityism.acs
+    import cityism.load.load_tiger as load_tiger
+    filename = make_shapes(workdir, args.scale)
+    loader = load_tiger.ShapeLoader('tract')
+    loader.fields = [(i[0].lower(), load_tiger.fieldtype(i)) for i in cityism.acs.ACSShape(filename).fields()]
+    def run():
+        cursor = StandInCursor()
+        cursor.copy_expert('', load_tiger.IterFile(loader.iterrows(filename)))
+        return args.scale
+    return run
+
+@benchmark('hist.breaks')
+def bench_breaks(workdir, args):
+    import cityism.hist
+    items = [{'hdi': random.uniform(0, 10), 'pop': random.randint(1000, 8000)} for i in range(args.scale)]
+    def run():
+        cityism.hist.breaks(items, key='hdi', metric='pop', count=10)
+        return len(items)
+    return run
+
+@benchmark('polyline.encode_decode')
+def bench_polyline(workdir, args):
+    import cityism.polyline
+    coords = [(-122.0 + i * 1e-4, 37.0 + math.sin(i / 100.0) * 1e-2) for i in range(args.scale)]
+    def run():
+        cityism.polyline.decode(cityism.polyline.encode_coords(coords))
+        return len(coords)
+    return run
+
+@benchmark('geodesic.annuli')
+def bench_geodesic(workdir, args):
+    import cityism.geodesic
+    radii = range(0, args.radial_end + args.radial_width, args.radial_width)
+    def run():
+        cityism.geodesic.annuli(args.lon, args.lat, radii)
+        return len(radii) - 1
+    return run
+
+@benchmark('radial.QueryRadial.query')
+def bench_radial(workdir, args):
+    if not args.db:
+        raise Skip("needs PostGIS; run with --db")
+    import cityism.config
+    import cityism.radial
+    conn = cityism.config.connect()
+    radii = range(args.radial_start, args.radial_end, args.radial_width)
+    def run():
+        for radius in radii:
+            cityism.radial.QueryRadial(conn=conn).query(lon=args.lon, lat=args.lat, acstable=args.acstable, radius_inner=radius, radius_outer=radius+args.radial_width)
+        return len(radii)
+    return run
+
+##### Runner #####
+
+def maxrss():
+    """Peak resident memory of this process, KB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss
+
+def _run(name, func, args, queue):
+    workdir = tempfile.mkdtemp(prefix='cityism_bench_')
+    cwd = os.getcwd()
+    random.seed(args.seed)
+    result = {'name': name}
+    try:
+        os.chdir(workdir)
+        # Silence the loaders' progress output.
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            run = func(workdir, args)
+            baseline = maxrss()
+            times = []
+            for i in range(args.repeat):
+                t = time.time()
+                items = run()
+                times.append(time.time() - t)
+        finally:
+            sys.stdout = stdout
+        times.sort()
+        result.update({
+            'items': items,
+            'repeat': args.repeat,
+            'best_s': times[0],
+            'median_s': times[len(times)//2],
+            'items_per_s': items / times[0] if times[0] else None,
+            'maxrss_kb': maxrss(),
+            'maxrss_delta_kb': maxrss() - baseline
+        })
+    except Skip, e:
+        result['skipped'] = str(e)
+    except ImportError, e:
+        result['skipped'] = 'missing dependency: %s'%e
+    except Exception, e:
+        result['error'] = '%s: %s'%(e.__class__.__name__, e)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    queue.put(result)
+
+def git_revision():
+    try:
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=cwd, stderr=open(os.devnull, 'w')).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", help="Synthetic tracts / items", default=10000, type=int)
+    parser.add_argument("--repeat", help="Timed iterations per benchmark", default=3, type=int)
+    parser.add_argument("--seed", help="Random seed", default=1, type=int)
+    parser.add_argument("--only", help="Run benchmarks whose name contains this", action="append", default=[])
+    parser.add_argument("--db", help="Run benchmarks that need PostGIS", action="store_true")
+    parser.add_argument("--lon", help="Radial query longitude", default=-121.89, type=float)
+    parser.add_argument("--lat", help="Radial query latitude", default=37.33, type=float)
+    parser.add_argument("--acstable", help="Radial query ACS table", default="B25034")
+    parser.add_argument("--radial_start", default=1000, type=int)
+    parser.add_argument("--radial_end", default=20000, type=int)
+    parser.add_argument("--radial_width", default=1000, type=int)
+    args = parser.parse_args()
+
+    results = []
+    for name, func in BENCHMARKS:
+        if args.only and not any(i in name for i in args.only):
+            continue
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_run, args=(name, func, args, queue))
+        p.start()
+        result = queue.get()
+        p.join()
+        print >> sys.stderr, name, result.get('best_s', result.get('skipped') or result.get('error'))
+        results.append(result)
+
+    print json.dumps({
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'scale': args.scale,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+    }, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
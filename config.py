@@ -1,8 +1,31 @@
-"""Cityism configuration."""
+"""Cityism configuration.
+
+Settings are read from config.json next to this file (or the file named by
+CITYISM_CONFIG), then from CITYISM_* environment variables:
+
+  {"host": "localhost", "port": 5432, "user": "irees", "password": "",
+   "dbname": "irees", "pool_min": 1, "pool_max": 8}
+
+  CITYISM_DB_HOST, CITYISM_DB_PORT, CITYISM_DB_USER, CITYISM_DB_PASSWORD,
+  CITYISM_DB_NAME, CITYISM_POOL_MIN, CITYISM_POOL_MAX
+
+connect() opens a new connection. Long-running services should use
+pooled(), which borrows a connection from a shared, size-bounded pool.
+prepare() registers a server-side prepared statement once per connection.
+copy_value() escapes values for COPY text format.
+"""
+import contextlib
+import json
+import os
+import threading
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+
+import cityism.instrument
 
-# TODO: Load from config.json
 srid = 4326
 
 host = 'localhost'
@@ -10,9 +33,132 @@ user = 'irees'
 password = ''
 port = 5432
 dbname = 'irees'
+pool_min = 1
+pool_max = 8
+
+ENVIRON = {
+    'CITYISM_DB_HOST': ('host', str),
+    'CITYISM_DB_PORT': ('port', int),
+    'CITYISM_DB_USER': ('user', str),
+    'CITYISM_DB_PASSWORD': ('password', str),
+    'CITYISM_DB_NAME': ('dbname', str),
+    'CITYISM_POOL_MIN': ('pool_min', int),
+    'CITYISM_POOL_MAX': ('pool_max', int)
+}
+
+def load(filename=None):
+    """Load settings from a JSON file and the environment."""
+    settings = {}
+    filename = filename or os.environ.get('CITYISM_CONFIG') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+    if os.path.exists(filename):
+        with open(filename) as f:
+            settings.update(json.load(f))
+    for key, (name, cast) in ENVIRON.items():
+        if key in os.environ:
+            settings[name] = cast(os.environ[key])
+    g = globals()
+    for name, value in settings.items():
+        if name in ('srid', 'host', 'user', 'password', 'port', 'dbname', 'pool_min', 'pool_max'):
+            g[name] = value
+
+class Connection(psycopg2.extensions.connection):
+    """Connection that remembers its prepared statements."""
+
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+def _connect_kwargs():
+    kw = {'dbname': dbname, 'user': user, 'password': password, 'host':host, 'port': port, 'connection_factory': Connection}
+    if cityism.instrument.ENABLED:
+        kw['cursor_factory'] = cityism.instrument.cursor_factory()
+    return kw
 
 def connect(**kwargs):
-    kw = {'dbname': dbname, 'user': user, 'password': password, 'host':host, 'port': port}
+    kw = _connect_kwargs()
     kw.update(kwargs)
-    return psycopg2.connect(**kw)
+    with cityism.instrument.stage('config.connect', host=kw['host'], dbname=kw['dbname']):
+        return psycopg2.connect(**kw)
+
+##### Pool #####
+
+class Pool(object):
+    """Thread-safe connection pool that blocks when all connections are in
+    use, instead of raising."""
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.semaphore = threading.BoundedSemaphore(maxconn)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **kwargs)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection; commit on success, roll back on error."""
+        self.semaphore.acquire()
+        try:
+            conn = self.pool.getconn()
+            try:
+                yield conn
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.semaphore.release()
+
+    def close(self):
+        self.pool.closeall()
+
+_POOL = {}
+_POOL_LOCK = threading.Lock()
+
+def pool():
+    """Return the shared pool, creating it on first use in each process."""
+    with _POOL_LOCK:
+        if _POOL.get('pid') != os.getpid():
+            _POOL['pool'] = Pool(pool_min, pool_max, **_connect_kwargs())
+            _POOL['pid'] = os.getpid()
+        return _POOL['pool']
+
+def pooled():
+    """Context manager borrowing a connection from the shared pool."""
+    return pool().connection()
+
+##### Prepared statements #####
+
+def prepare(conn, name, query, types=None):
+    """Register a server-side prepared statement on a connection, once.
+    Query uses $1, $2, ... placeholders. Return the statement name."""
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is not None and name in prepared:
+        return name
+    with conn.cursor() as cursor:
+        if prepared is None:
+            # Not a config.Connection: ask the server.
+            cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (name,))
+            if cursor.fetchone():
+                return name
+        if types:
+            cursor.execute("PREPARE %s (%s) AS %s"%(name, ', '.join(types), query))
+        else:
+            cursor.execute("PREPARE %s AS %s"%(name, query))
+    if prepared is not None:
+        prepared.add(name)
+    return name
+
+def execute(cursor, name, params):
+    """Execute a prepared statement with positional parameters."""
+    cursor.execute("EXECUTE %s (%s)"%(name, ', '.join(['%s'] * len(params))), params)
+
+##### COPY #####
+
+def copy_value(value):
+    """Escape a value for COPY text format. None is NULL."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
 
+load()
@@ -0,0 +1,163 @@
+"""Enrich a point CSV with Census geography, ACS/LODES values and radial
+aggregates.
+
+All points are copied into a temporary, spatially indexed table. One
+set-based query then assigns each point its tract and block group,
+attaches the selected columns, and computes area-weighted sums within
+each radius. Every point is handled in that one pass, instead of one
+QueryRadial per point.
+
+Example, for VTA stop ridership:
+
+  python enrich.py data/VTA_2013Ridership_Transform.csv --join acs_b01001:b01001_001 --join lodes_wac:lodes_c000 --radius 400 --radius 800 > enriched.csv
+
+"""
+import argparse
+import csv
+import re
+import StringIO
+import sys
+
+import cityism.config
+import cityism.export
+
+def column_name(value):
+    """Sanitize a CSV header for use as a column name."""
+    name = re.sub('[^a-z0-9_]', '_', value.strip().lower())
+    if not re.match('[a-z]', name):
+        name = 'c_%s'%name
+    return name
+
+def column_names(header):
+    """Sanitized, unique column names for a CSV header. Repeated names get
+    a numeric suffix; names used by the points table are avoided."""
+    ret = []
+    seen = set(['pt_id', 'pt_lon', 'pt_lat', 'pt_geom'])
+    for value in header:
+        name = base = column_name(value)
+        count = 1
+        while name in seen:
+            count += 1
+            name = '%s_%d'%(base, count)
+        seen.add(name)
+        ret.append(name)
+    return ret
+
+def copy_points(cursor, filename, lon='Long', lat='Lat', batch=10000):
+    """COPY a point CSV into the temporary table "points". Return the
+    original column names."""
+    with open(filename, 'rU') as f:
+        reader = csv.reader(f)
+        header = reader.next()
+        columns = column_names(header)
+        ilon, ilat = header.index(lon), header.index(lat)
+        cursor.execute("""CREATE TEMPORARY TABLE points (pt_id SERIAL, %s, pt_lon DOUBLE PRECISION, pt_lat DOUBLE PRECISION);"""%(
+            ','.join('"%s" VARCHAR'%i for i in columns)
+        ))
+        while True:
+            buf = StringIO.StringIO()
+            rows = 0
+            for row in reader:
+                buf.write('\t'.join([cityism.config.copy_value(i) for i in row] + [cityism.config.copy_value(row[ilon] or None), cityism.config.copy_value(row[ilat] or None)]))
+                buf.write('\n')
+                rows += 1
+                if rows >= batch:
+                    break
+            if not rows:
+                break
+            buf.seek(0)
+            cursor.copy_from(buf, 'points', columns=columns + ['pt_lon', 'pt_lat'])
+    cursor.execute("""
+        ALTER TABLE points ADD COLUMN pt_geom geometry(Point, 4326);
+        UPDATE points SET pt_geom = ST_SetSRID(ST_MakePoint(pt_lon, pt_lat), 4326);
+        CREATE INDEX points_geom_idx ON points USING GIST (pt_geom);
+        ANALYZE points;
+    """)
+    return columns
+
+def build_query(columns, joins=None, radii=None, tract='tract', bg='bg'):
+    """Build the enrichment query over the "points" table."""
+    joins = joins or []
+    radii = sorted(set(radii or []))
+    select = ['p."%s"'%i for i in columns]
+    select += ['tract.geoid AS tract_geoid', 'bg.geoid AS bg_geoid']
+    joincolumns, tract_joins = cityism.export.build_joins(joins, alias='tract')
+    select += joincolumns
+    join_clauses = [tract_joins]
+
+    # Radial aggregates: tract values weighted by the fraction of each
+    # tract's area inside a geodesic buffer around the point.
+    for radius in radii:
+        alias = 'r%d'%radius
+        sums = []
+        for jointable, joincolumns in joins:
+            sums += ['SUM(%s.%s * w.fraction) AS %s_%s'%(jointable, i, i, alias) for i in joincolumns]
+            select += ['%s.%s_%s'%(alias, i, alias) for i in joincolumns]
+        radial_joins = cityism.export.build_joins(joins, alias='w')[1]
+        if not sums:
+            continue
+        join_clauses.append("""
+            LEFT JOIN LATERAL (
+                SELECT %(sums)s
+                FROM (
+                    SELECT
+                        t.geoid,
+                        ST_Area(ST_Intersection(t.geom, b.buffer)::geography) / NULLIF(ST_Area(t.geom::geography), 0) AS fraction
+                    FROM
+                        (SELECT ST_Buffer(p.pt_geom::geography, %(radius)s)::geometry AS buffer) AS b,
+                        %(tract)s AS t
+                    WHERE ST_Intersects(t.geom, b.buffer)
+                ) AS w
+                %(joins)s
+            ) AS %(alias)s ON true
+        """%{'sums': ', '.join(sums), 'radius': float(radius), 'tract': tract, 'joins': radial_joins, 'alias': alias})
+
+    return """
+        SELECT %(select)s
+        FROM points AS p
+        LEFT JOIN LATERAL (SELECT t.geoid FROM %(tract)s AS t WHERE ST_Intersects(t.geom, p.pt_geom) LIMIT 1) AS tract ON true
+        LEFT JOIN LATERAL (SELECT t.geoid FROM %(bg)s AS t WHERE ST_Intersects(t.geom, p.pt_geom) LIMIT 1) AS bg ON true
+        %(joins)s
+        ORDER BY p.pt_id;
+    """%{'select': ', '.join(select), 'tract': tract, 'bg': bg, 'joins': ' '.join(join_clauses)}
+
+def enrich(filename, out=None, table=None, lon='Long', lat='Lat', joins=None, radii=None, tract='tract', bg='bg', batch=2000):
+    """Enrich a point CSV. Write CSV to out, or create table. Return rows."""
+    count = 0
+    with cityism.config.connect() as conn:
+        with conn.cursor() as cursor:
+            columns = copy_points(cursor, filename, lon=lon, lat=lat)
+            query = build_query(columns, joins=joins, radii=radii, tract=tract, bg=bg)
+            if table:
+                cursor.execute("""CREATE TABLE %s AS %s"""%(table, query.strip().rstrip(';')))
+                return cursor.rowcount
+        with conn.cursor(name='cityism_enrich') as cursor:
+            cursor.itersize = batch
+            cursor.execute(query)
+            writer = csv.writer(out or sys.stdout)
+            header = False
+            for row in cursor:
+                if not header:
+                    writer.writerow([i[0] for i in cursor.description])
+                    header = True
+                writer.writerow(row)
+                count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="Point CSV")
+    parser.add_argument("--lon", help="Longitude column", default="Long")
+    parser.add_argument("--lat", help="Latitude column", default="Lat")
+    parser.add_argument("--join", help="Join table and columns, e.g. lodes_wac:lodes_c000", type=cityism.export.parse_join, action="append", default=[])
+    parser.add_argument("--radius", help="Radial aggregate radius, meters", type=int, action="append", default=[])
+    parser.add_argument("--tract", help="Tract table", default="tract")
+    parser.add_argument("--bg", help="Block group table", default="bg")
+    parser.add_argument("--table", help="Write to this table instead of CSV")
+    args = parser.parse_args()
+
+    count = enrich(args.filename, table=args.table, lon=args.lon, lat=args.lat, joins=args.join, radii=args.radius, tract=args.tract, bg=args.bg)
+    print >> sys.stderr, "Enriched %s points"%count
+
+if __name__ == "__main__":
+    main()
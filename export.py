@@ -0,0 +1,134 @@
+"""Streaming GeoJSON export.
+
+Features are fetched from a server-side (named) cursor in batches and
+written to the output as they arrive, so memory use does not grow with the
+size of the result set.
+
+Example: export tract centroids with population and jobs for California:
+
+  python export.py --state 06 --join acs_b01001:b01001_001 --join lodes_wac:lodes_c000
+
+"""
+import argparse
+import json
+import sys
+
+import psycopg2.extras
+
+import cityism.config
+
+def build_joins(joins, alias='geo', how='LEFT'):
+    """Columns and JOIN clauses for (table, [columns]) joins on geoid.
+    Return ([table.column, ...], clauses)."""
+    columns, clauses = [], []
+    for jointable, joincolumns in joins or []:
+        columns += ['%s.%s'%(jointable, i) for i in joincolumns]
+        clauses.append('%(how)s JOIN %(t)s ON %(t)s.geoid = %(alias)s.geoid'%{'how':how, 't':jointable, 'alias':alias})
+    return columns, ' '.join(clauses)
+
+def build_query(table='tract_2012', joins=None, state=None, geometry='point'):
+    """Build the export query. Return (query, params).
+
+    Joins are (table, [columns]) tuples, joined on geoid. Geometry is either
+    'point' (the internal point, intptlon/intptlat) or 'polygon' (geom).
+    """
+    joins = joins or []
+    columns = ['geo.geoid']
+    if geometry == 'point':
+        columns += ['geo.intptlon', 'geo.intptlat']
+    elif geometry == 'polygon':
+        columns += ['ST_AsGeoJSON(geo.geom) AS geojson']
+    else:
+        raise Exception("Unknown geometry type: %s"%geometry)
+
+    joincolumns, join_clauses = build_joins(joins, how='INNER')
+    columns += joincolumns
+
+    query = """SELECT %(columns)s FROM %(table)s AS geo %(joins)s"""%{
+        'columns': ', '.join(columns),
+        'table': table,
+        'joins': join_clauses
+    }
+    params = {}
+    if state:
+        query += """ WHERE geo.statefp = %(statefp)s"""
+        params['statefp'] = state
+    return query + ';', params
+
+def iterrows(conn, query, params=None, batch=2000):
+    """Iterate over query results using a named (server-side) cursor."""
+    with conn.cursor(name='cityism_export', cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.itersize = batch
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+
+def feature(row, properties):
+    """Convert a row to a GeoJSON Feature."""
+    if 'geojson' in row.keys():
+        geometry = json.loads(row['geojson'])
+    else:
+        geometry = {'type': 'Point', 'coordinates': [float(row['intptlon']), float(row['intptlat'])]}
+    return {
+        'type': 'Feature',
+        'id': row['geoid'],
+        'geometry': geometry,
+        'properties': properties(row)
+    }
+
+def write_geojson(features, f, properties=None):
+    """Write a FeatureCollection, one feature at a time."""
+    base = {'type': 'FeatureCollection'}
+    if properties:
+        base['properties'] = properties
+    # Emit the collection header, then splice in the features array.
+    header = json.dumps(base)[:-1]
+    f.write(header + ', "features": [\n')
+    count = 0
+    for feat in features:
+        if count:
+            f.write(',\n')
+        f.write(json.dumps(feat))
+        count += 1
+    f.write('\n]}\n')
+    return count
+
+def write_geojsonl(features, f):
+    """Write newline-delimited GeoJSON, one Feature per line."""
+    count = 0
+    for feat in features:
+        f.write(json.dumps(feat))
+        f.write('\n')
+        count += 1
+    return count
+
+def parse_join(value):
+    """Parse a --join argument: "table:col1,col2"."""
+    table, _, columns = value.partition(':')
+    if not columns:
+        raise argparse.ArgumentTypeError("Join must be table:col1,col2")
+    return table, columns.split(',')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", help="Geography table", default="tract_2012")
+    parser.add_argument("--state", help="State FIPS code, e.g. 06")
+    parser.add_argument("--join", help="Join table and columns, e.g. acs_b01001:b01001_001", type=parse_join, action="append", default=[])
+    parser.add_argument("--geometry", help="Feature geometry", choices=['point', 'polygon'], default='point')
+    parser.add_argument("--format", help="Output format", choices=['geojson', 'geojsonl'], default='geojson')
+    parser.add_argument("--batch", help="Rows fetched per round trip", default=2000, type=int)
+    args = parser.parse_args()
+
+    query, params = build_query(table=args.table, joins=args.join, state=args.state, geometry=args.geometry)
+    keys = [column for table, columns in args.join for column in columns]
+    properties = lambda row:dict((k, row[k]) for k in keys)
+
+    with cityism.config.connect() as conn:
+        features = (feature(row, properties) for row in iterrows(conn, query, params, batch=args.batch))
+        if args.format == 'geojsonl':
+            write_geojsonl(features, sys.stdout)
+        else:
+            write_geojson(features, sys.stdout)
+
+if __name__ == "__main__":
+    main()
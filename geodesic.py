@@ -0,0 +1,91 @@
+"""Geodesic circles and annuli on the WGS84 ellipsoid.
+
+Ring vertices are computed with Vincenty's direct formula, vectorized with
+NumPy over points, radii and bearings at once. They are accurate anywhere,
+including across UTM zone boundaries, with no reprojection. Annuli are
+returned as EWKB polygons (SRID 4326) to pass to PostGIS as parameters.
+"""
+import numpy
+
+import cityism.wkb
+
+# WGS84
+A = 6378137.0
+F = 1 / 298.257223563
+B = (1 - F) * A
+
+def direct(lon, lat, azimuth, distance, tolerance=1e-12, iterations=200):
+    """Vincenty direct problem: the point at distance (meters) along
+    azimuth (degrees) from lon, lat (degrees). Arguments broadcast
+    together. Return (lon, lat) arrays in degrees."""
+    lon, lat, azimuth, distance = numpy.broadcast_arrays(
+        numpy.asarray(lon, dtype=float),
+        numpy.asarray(lat, dtype=float),
+        numpy.asarray(azimuth, dtype=float),
+        numpy.asarray(distance, dtype=float)
+    )
+    alpha1 = numpy.radians(azimuth)
+    sin_alpha1, cos_alpha1 = numpy.sin(alpha1), numpy.cos(alpha1)
+    tan_u1 = (1 - F) * numpy.tan(numpy.radians(lat))
+    cos_u1 = 1 / numpy.sqrt(1 + tan_u1 ** 2)
+    sin_u1 = tan_u1 * cos_u1
+    sigma1 = numpy.arctan2(tan_u1, cos_alpha1)
+    sin_alpha = cos_u1 * sin_alpha1
+    cos2_alpha = 1 - sin_alpha ** 2
+    u2 = cos2_alpha * (A ** 2 - B ** 2) / B ** 2
+    a = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    b = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+
+    sigma = distance / (B * a)
+    for i in range(iterations):
+        cos_2sigma_m = numpy.cos(2 * sigma1 + sigma)
+        sin_sigma, cos_sigma = numpy.sin(sigma), numpy.cos(sigma)
+        delta_sigma = b * sin_sigma * (cos_2sigma_m + b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        ))
+        previous, sigma = sigma, distance / (B * a) + delta_sigma
+        if numpy.all(numpy.abs(sigma - previous) < tolerance):
+            break
+
+    cos_2sigma_m = numpy.cos(2 * sigma1 + sigma)
+    sin_sigma, cos_sigma = numpy.sin(sigma), numpy.cos(sigma)
+    tmp = sin_u1 * sin_sigma - cos_u1 * cos_sigma * cos_alpha1
+    lat2 = numpy.arctan2(
+        sin_u1 * cos_sigma + cos_u1 * sin_sigma * cos_alpha1,
+        (1 - F) * numpy.sqrt(sin_alpha ** 2 + tmp ** 2)
+    )
+    lam = numpy.arctan2(sin_sigma * sin_alpha1, cos_u1 * cos_sigma - sin_u1 * sin_sigma * cos_alpha1)
+    c = F / 16 * cos2_alpha * (4 + F * (4 - 3 * cos2_alpha))
+    l = lam - (1 - c) * F * sin_alpha * (sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+    return lon + numpy.degrees(l), numpy.degrees(lat2)
+
+def circles(lons, lats, radii, vertices=64):
+    """Geodesic circles around every point for every radius.
+
+    Return an array of shape (points, radii, vertices+1, 2) of lon, lat
+    rings, closed and counter-clockwise."""
+    lons = numpy.atleast_1d(numpy.asarray(lons, dtype=float))[:, None, None]
+    lats = numpy.atleast_1d(numpy.asarray(lats, dtype=float))[:, None, None]
+    radii = numpy.atleast_1d(numpy.asarray(radii, dtype=float))[None, :, None]
+    # Clockwise bearings from north trace a counter-clockwise ring.
+    azimuths = numpy.linspace(360.0, 0.0, vertices, endpoint=False)[None, None, :]
+    lon2, lat2 = direct(lons, lats, azimuths, radii)
+    rings = numpy.stack([lon2, lat2], axis=-1)
+    return numpy.concatenate([rings, rings[:, :, :1]], axis=2)
+
+def annulus(outer, inner=None, srid=4326):
+    """EWKB polygon between two rings from circles(). Without an inner
+    ring (or a zero radius), return the outer disc."""
+    rings = [outer.tolist()]
+    if inner is not None and numpy.ptp(inner[:, 0]) > 0:
+        rings.append(inner[::-1].tolist())
+    return cityism.wkb.polygon(rings, srid=srid)
+
+def annuli(lon, lat, radii, vertices=64, srid=4326):
+    """EWKB annuli between consecutive radii around one point: for radii
+    [r0, r1, r2], return [annulus(r0, r1), annulus(r1, r2)]."""
+    if any(b <= a for a, b in zip(radii, radii[1:])):
+        raise Exception("Radii must be increasing: %s"%(list(radii),))
+    rings = circles(lon, lat, radii, vertices=vertices)[0]
+    return [annulus(rings[i+1], rings[i], srid=srid) for i in range(len(radii)-1)]
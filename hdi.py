@@ -0,0 +1,227 @@
+"""Build the result_hdi table: a tract-level Human Development Index.
+
+The index follows the American HDI (Measure of America), on a 0-10 scale:
+the mean of a health, an education and an income index.
+
+  health:    life expectancy (data_life_expectancy_tract, the county values
+             broadcast to tracts by load_lifeexptancy.py), goalposts
+             66 - 90 years.
+  education: attainment score from B15003, the share of adults 25+ with a
+             high school diploma, a bachelor's degree, and a graduate
+             degree, summed; goalposts 0.5 - 2.0. (Enrollment is not used.)
+  income:    log per capita income from B19301, goalposts $17,234.09 -
+             $55,949.49.
+
+Jobs (lodes_wac) and population (B01001) are carried along for weighting
+and density. The computation is vectorized with NumPy.
+
+Builds are incremental. A signature of the source columns used here (for
+tract geometry, which is copied into result_hdi, an md5 of its WKB) is kept
+per state in result_hdi_state. Only states whose source rows changed since
+the last build are recomputed; with --state, only those states are read.
+"""
+import argparse
+import StringIO
+
+import numpy
+
+import cityism.config
+
+HEALTH = (66.0, 90.0)
+EDUCATION = (0.5, 2.0)
+INCOME = (17234.09, 55949.49)
+
+# B15003 columns: total, high school diploma or higher, bachelor's or
+# higher, graduate or professional degree.
+B15003_TOTAL = 'b15003_001'
+B15003_HS = ['b15003_%03d'%i for i in range(17, 26)]
+B15003_BA = ['b15003_%03d'%i for i in range(22, 26)]
+B15003_GRAD = ['b15003_%03d'%i for i in range(23, 26)]
+
+COLUMNS = ['geoid', 'statefp', 'pop', 'aland', 'jobs', 'le', 'health', 'education', 'income', 'hdi']
+
+def sources(tract='tract'):
+    """Return {source table: (SQL expression giving each row's state,
+    columns or expressions used by the build)}."""
+    return {
+        tract: ('statefp', ['geoid', 'aland', 'md5(ST_AsBinary(geom))']),
+        'acs_b01001': ('substr(geoid, 1, 2)', ['geoid', 'b01001_001']),
+        'acs_b15003': ('substr(geoid, 1, 2)', ['geoid', B15003_TOTAL] + B15003_HS),
+        'acs_b19301': ('substr(geoid, 1, 2)', ['geoid', 'b19301_001']),
+        'lodes_wac': ('substr(geoid, 1, 2)', ['geoid', 'lodes_c000']),
+        'data_life_expectancy_tract': ('substr(geoid, 1, 2)', ['geoid', 'le'])
+    }
+
+def state_filter(cursor, columns, states):
+    """WHERE clause limiting a source to states. Geoid prefixes are
+    matched as ranges, so the geoid index can be used."""
+    if 'geoid' not in columns:
+        return cursor.mogrify("WHERE statefp IN %s", (tuple(states),))
+    ranges = [cursor.mogrify("(geoid >= %s AND geoid < %s)", (i, '%02d'%(int(i)+1))) for i in sorted(states)]
+    return "WHERE " + " OR ".join(ranges)
+
+def signatures(cursor, tract='tract', states=None):
+    """Return {(source, statefp): md5 of the used source columns in that
+    state}, optionally for some states only."""
+    ret = {}
+    for source, (state, columns) in sources(tract).items():
+        where = ''
+        if states:
+            where = state_filter(cursor, columns, states)
+        cursor.execute("""
+            SELECT %(state)s, md5(string_agg(md5(row(%(columns)s)::text), '' ORDER BY %(order)s))
+            FROM %(source)s AS t
+            %(where)s
+            GROUP BY 1;
+        """%{'source':source, 'state':state, 'columns':', '.join(columns), 'order':', '.join(columns), 'where':where})
+        for statefp, signature in cursor:
+            ret[(source, statefp)] = signature
+    return ret
+
+def changed_states(old, new):
+    """States with any source signature added, removed, or changed."""
+    keys = set(old.keys()) | set(new.keys())
+    return sorted(set(k[1] for k in keys if old.get(k) != new.get(k)))
+
+def index(values, goalposts, log=False):
+    """Scale values between goalposts."""
+    low, high = goalposts
+    if log:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            values = numpy.where(values > 0, numpy.log(values), numpy.nan)
+        low, high = numpy.log(low), numpy.log(high)
+    return (values - low) / (high - low)
+
+def compute(data):
+    """Compute index columns from a dict of float arrays."""
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        total = data[B15003_TOTAL]
+        score = sum(data[i] for i in B15003_HS) / total
+        score += sum(data[i] for i in B15003_BA) / total
+        score += sum(data[i] for i in B15003_GRAD) / total
+    health = index(data['le'], HEALTH)
+    education = index(score, EDUCATION)
+    income = index(data['b19301_001'], INCOME, log=True)
+    return {
+        'health': health,
+        'education': education,
+        'income': income,
+        'hdi': (health + education + income) / 3 * 10
+    }
+
+def fetch(cursor, states, tract='tract'):
+    """Fetch source values for tracts in states. Return (geoids, statefps,
+    dict of float arrays)."""
+    columns = ['b01001_001', B15003_TOTAL] + B15003_HS + ['b19301_001', 'lodes_c000', 'le', 'aland']
+    cursor.execute("""
+        SELECT
+            tract.geoid,
+            tract.statefp,
+            acs_b01001.b01001_001,
+            %(b15003)s,
+            acs_b19301.b19301_001,
+            lodes_wac.lodes_c000,
+            le.le,
+            tract.aland
+        FROM %(tract)s AS tract
+        LEFT JOIN acs_b01001 ON acs_b01001.geoid = tract.geoid
+        LEFT JOIN acs_b15003 ON acs_b15003.geoid = tract.geoid
+        LEFT JOIN acs_b19301 ON acs_b19301.geoid = tract.geoid
+        LEFT JOIN lodes_wac ON lodes_wac.geoid = tract.geoid
+        LEFT JOIN data_life_expectancy_tract AS le ON le.geoid = tract.geoid
+        WHERE tract.statefp IN %%(states)s;
+    """%{
+        'tract': tract,
+        'b15003': ','.join('acs_b15003.%s'%i for i in [B15003_TOTAL] + B15003_HS)
+    }, {'states': tuple(states)})
+    rows = cursor.fetchall()
+    geoids = [i[0] for i in rows]
+    statefps = [i[1] for i in rows]
+    values = numpy.array([i[2:] for i in rows], dtype=float).reshape(len(rows), len(columns))
+    return geoids, statefps, dict(zip(columns, values.T))
+
+def _fmt(value):
+    if value is None or value != value:
+        return '\\N'
+    return repr(float(value))
+
+def build(states=None, tract='tract', full=False):
+    """Recompute result_hdi for changed states. Return the states rebuilt."""
+    with cityism.config.connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS result_hdi (
+                    geoid VARCHAR NOT NULL PRIMARY KEY,
+                    statefp VARCHAR(2),
+                    pop FLOAT,
+                    aland FLOAT,
+                    jobs FLOAT,
+                    le FLOAT,
+                    health FLOAT,
+                    education FLOAT,
+                    income FLOAT,
+                    hdi FLOAT,
+                    geom geometry
+                );
+                CREATE INDEX IF NOT EXISTS result_hdi_statefp_idx ON result_hdi (statefp);
+                CREATE TABLE IF NOT EXISTS result_hdi_state (
+                    source VARCHAR NOT NULL,
+                    statefp VARCHAR(2) NOT NULL,
+                    signature VARCHAR,
+                    PRIMARY KEY (source, statefp)
+                );
+            """)
+            cursor.execute("""SELECT source, statefp, signature FROM result_hdi_state;""")
+            old = dict(((i[0], i[1]), i[2]) for i in cursor if not states or i[1] in states)
+            new = signatures(cursor, tract=tract, states=states)
+            if full:
+                rebuild = sorted(set(k[1] for k in new))
+            else:
+                rebuild = changed_states(old, new)
+            if not rebuild:
+                return []
+
+            geoids, statefps, data = fetch(cursor, rebuild, tract=tract)
+            result = compute(data)
+            result.update({'pop': data['b01001_001'], 'aland': data['aland'], 'jobs': data['lodes_c000'], 'le': data['le']})
+
+            buf = StringIO.StringIO()
+            for i, geoid in enumerate(geoids):
+                buf.write('\t'.join([geoid, statefps[i]] + [_fmt(result[k][i]) for k in COLUMNS[2:]]))
+                buf.write('\n')
+            buf.seek(0)
+
+            cursor.execute("""
+                DELETE FROM result_hdi WHERE statefp IN %(states)s;
+                CREATE TEMPORARY TABLE result_hdi_new (LIKE result_hdi) ON COMMIT DROP;
+            """, {'states': tuple(rebuild)})
+            cursor.copy_from(buf, 'result_hdi_new', columns=COLUMNS)
+            cursor.execute("""
+                INSERT INTO result_hdi
+                SELECT %(columns)s, tract.geom
+                FROM result_hdi_new AS r
+                INNER JOIN %(tract)s AS tract ON tract.geoid = r.geoid;
+            """%{'columns': ','.join('r.%s'%i for i in COLUMNS), 'tract': tract})
+
+            # Record signatures for the rebuilt states only.
+            cursor.execute("""DELETE FROM result_hdi_state WHERE statefp IN %(states)s;""", {'states': tuple(rebuild)})
+            for (source, statefp), signature in new.items():
+                if statefp in rebuild:
+                    cursor.execute("""INSERT INTO result_hdi_state VALUES (%s, %s, %s);""", (source, statefp, signature))
+    return rebuild
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state", help="Only consider these state FIPS codes", action="append", default=[])
+    parser.add_argument("--tract", help="Tract table", default="tract")
+    parser.add_argument("--full", help="Rebuild all states", action="store_true")
+    args = parser.parse_args()
+
+    rebuilt = build(states=args.state, tract=args.tract, full=args.full)
+    if rebuilt:
+        print "Rebuilt states: %s"%', '.join(rebuilt)
+    else:
+        print "result_hdi is up to date"
+
+if __name__ == "__main__":
+    main()
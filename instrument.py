@@ -0,0 +1,217 @@
+"""Timing and counters for loads and queries.
+
+Instrumentation is off by default, and stage() then returns a shared no-op
+context manager. To enable it, set CITYISM_INSTRUMENT to an output file
+('-' for stderr), or call enable().
+
+  CITYISM_INSTRUMENT=-                     JSON lines, one event per stage
+  CITYISM_INSTRUMENT_FORMAT=prometheus     Prometheus text totals, at exit
+  CITYISM_INSTRUMENT_EXPLAIN=1             Capture EXPLAIN ANALYZE plans
+
+Usage:
+
+  with cityism.instrument.stage('load_lodes.load_file', filename=filename) as s:
+      ...
+      s.add(rows=len(keys), bytes=size)
+
+When enabled, config.connect() returns connections whose default cursors
+record the time, statement count and row count of every SQL statement.
+
+Prometheus totals are written by the parent process at exit. Tasks run in
+multiprocessing pools must be wrapped with Task and their results unwrapped
+with results(), so totals recorded in workers are sent back to the parent:
+
+  for result in cityism.instrument.results(pool.imap_unordered(cityism.instrument.Task(func), tasks)):
+      ...
+"""
+import atexit
+import json
+import os
+import sys
+import time
+
+ENABLED = False
+EXPLAIN = False
+FORMAT = 'json'
+OUT = None
+
+# Totals for Prometheus output: {(metric, labels): value}
+TOTALS = {}
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add(self, **counters):
+        pass
+
+NULLSTAGE = _NullStage()
+
+class Stage(object):
+    """A timed stage with counters."""
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.counters = {}
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.time() - self.start
+        event = {'stage': self.name, 'seconds': seconds}
+        event.update(self.labels)
+        event.update(self.counters)
+        if exc_type:
+            event['error'] = exc_type.__name__
+        emit(event)
+        total(self.name, seconds=seconds, calls=1, **self.counters)
+        return False
+
+    def add(self, **counters):
+        for k,v in counters.items():
+            self.counters[k] = self.counters.get(k, 0) + (v or 0)
+
+def enable(out='-', fmt='json', explain=False):
+    """Enable instrumentation. Out is a filename, '-' for stderr, or a
+    file-like object."""
+    global ENABLED, EXPLAIN, FORMAT, OUT
+    if out == '-':
+        out = sys.stderr
+    elif isinstance(out, basestring):
+        out = open(out, 'a')
+    ENABLED, EXPLAIN, FORMAT, OUT = True, explain, fmt, out
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+def stage(name, **labels):
+    """Return a context manager timing a stage."""
+    if not ENABLED:
+        return NULLSTAGE
+    return Stage(name, labels)
+
+def emit(event):
+    """Write a JSON line event."""
+    if ENABLED and FORMAT == 'json':
+        event['time'] = time.time()
+        OUT.write(json.dumps(event, sort_keys=True, default=str))
+        OUT.write('\n')
+        OUT.flush()
+
+def total(name, **counters):
+    for k,v in counters.items():
+        key = (k, name)
+        TOTALS[key] = TOTALS.get(key, 0) + v
+
+def collect():
+    """Return and reset the totals recorded in this process."""
+    ret = dict(TOTALS)
+    TOTALS.clear()
+    return ret
+
+def merge(totals):
+    """Add totals collected in another process."""
+    for key, value in totals.items():
+        TOTALS[key] = TOTALS.get(key, 0) + value
+
+class Task(object):
+    """Wrap a pool task function to return (result, worker totals)."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        result = self.func(*args)
+        return result, collect()
+
+def results(iterable):
+    """Unwrap Task results in the parent, merging the worker totals."""
+    for result, totals in iterable:
+        merge(totals)
+        yield result
+
+def write_prometheus(f):
+    """Write totals in Prometheus text exposition format."""
+    metrics = sorted(set(k[0] for k in TOTALS))
+    for metric in metrics:
+        name = 'cityism_stage_%s_total'%metric
+        f.write('# TYPE %s counter\n'%name)
+        for (m, stagename), value in sorted(TOTALS.items()):
+            if m == metric:
+                f.write('%s{stage="%s"} %s\n'%(name, stagename, value))
+    f.flush()
+
+def _atexit():
+    if ENABLED and FORMAT == 'prometheus':
+        write_prometheus(OUT)
+
+atexit.register(_atexit)
+
+##### SQL #####
+
+_CURSOR = {}
+
+def cursor_factory():
+    """Return a cursor class recording time and row counts of each
+    statement. psycopg2 is only imported when this is first called."""
+    if 'cursor' in _CURSOR:
+        return _CURSOR['cursor']
+    import psycopg2.extensions
+
+    class InstrumentedCursor(psycopg2.extensions.cursor):
+        """Cursor recording time and row counts of each statement."""
+
+        def execute(self, query, vars=None):
+            start = time.time()
+            try:
+                return super(InstrumentedCursor, self).execute(query, vars)
+            finally:
+                self._record('sql.execute', start, query)
+
+        def copy_from(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return super(InstrumentedCursor, self).copy_from(*args, **kwargs)
+            finally:
+                self._record('sql.copy', start, 'COPY %s'%(args[1] if len(args) > 1 else kwargs.get('table')))
+
+        def copy_expert(self, sql, *args, **kwargs):
+            start = time.time()
+            try:
+                return super(InstrumentedCursor, self).copy_expert(sql, *args, **kwargs)
+            finally:
+                self._record('sql.copy', start, sql)
+
+        def _record(self, name, start, query):
+            seconds = time.time() - start
+            rows = max(self.rowcount, 0)
+            emit({'stage': name, 'seconds': seconds, 'rows': rows, 'sql': ' '.join(str(query).split())[:200]})
+            total(name, seconds=seconds, calls=1, rows=rows)
+
+    _CURSOR['cursor'] = InstrumentedCursor
+    return InstrumentedCursor
+
+def explain(cursor, query, params=None, name='sql.explain'):
+    """Capture EXPLAIN ANALYZE for a query, if enabled. Note that ANALYZE
+    runs the query."""
+    if not (ENABLED and EXPLAIN):
+        return None
+    cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, params)
+    plan = cursor.fetchone()[0]
+    emit({'stage': name, 'plan': plan})
+    return plan
+
+if os.environ.get('CITYISM_INSTRUMENT'):
+    enable(
+        out=os.environ['CITYISM_INSTRUMENT'],
+        fmt=os.environ.get('CITYISM_INSTRUMENT_FORMAT', 'json'),
+        explain=os.environ.get('CITYISM_INSTRUMENT_EXPLAIN') == '1'
+    )
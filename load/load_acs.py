@@ -1,7 +1,43 @@
-"""Load data from ACS tables into SQL."""
+"""Load data from ACS tables into SQL.
+
+With --years, several releases are loaded into the year-partitioned
+acs_ts_<table> tables instead (see timeseries.py).
+"""
 import argparse
 import cityism.acs
 import cityism.config
+import cityism.instrument
+
+def create_table(cursor, acstable, children):
+    query_acs_create = """
+        CREATE TABLE IF NOT EXISTS acs_%(acstable)s (
+        	geoid VARCHAR NOT NULL PRIMARY KEY,
+            %(columns)s
+        );
+    """%{
+        'acstable': acstable.acstable,
+        'columns': ','.join(['%s INTEGER'%i.acstable for i in children]),
+    }
+    cursor.execute(query_acs_create)
+
+def insert_tracts(conn, cursor, acstable, children, tracts):
+    """Insert parsed ACSTracts with a prepared statement. Return rows."""
+    # Prepared once per connection: $1 geoid, $2... children.
+    query_acs_insert = """
+         INSERT INTO acs_%(acstable)s 
+         VALUES (
+             $1,
+             %(children)s
+            )
+    """%{
+        'acstable': acstable.acstable,
+        'children': ','.join(['$%d'%(i+2) for i in range(len(children))])
+    }
+    keys = ['geoid'] + [i.acstable for i in children]
+    name = cityism.config.prepare(conn, 'acs_insert_%s'%acstable.acstable.lower(), query_acs_insert)
+    for tract in tracts:
+        cityism.config.execute(cursor, name, [tract.data.get(k) for k in keys])
+    return len(tracts)
 
 def main():
     parser = argparse.ArgumentParser()
@@ -9,6 +45,8 @@ def main():
     parser.add_argument("--span", help="Span", default=5, type=int)
     parser.add_argument("--state", help="State", default='*')
     parser.add_argument("--acstable", help="ACS Table")
+    parser.add_argument("--years", help="Load several release years into acs_ts_<table>", nargs='+', type=int)
+    parser.add_argument("--cache", help="Time series cache directory (default: timeseries.CACHEDIR)")
     args = parser.parse_args()
 
     year, span = args.year, args.span
@@ -25,6 +63,14 @@ def main():
     else:
       states = [args.state]
     
+    if args.years:
+      # Only the time series path needs NumPy.
+      import cityism.timeseries
+      for state in states:
+        for acstable in acstables:
+          cityism.timeseries.load(acstable, sorted(args.years), span=span, state=state, cachedir=args.cache or cityism.timeseries.CACHEDIR)
+      return
+
     for state in states:
       for acstable in acstables:
         print "Loading states %s table %s"%(state, acstable)
@@ -37,36 +83,12 @@ def main():
           print e
           continue
 
-        query_acs_create = """
-            CREATE TABLE IF NOT EXISTS acs_%(acstable)s (
-            	geoid VARCHAR NOT NULL PRIMARY KEY,
-                %(columns)s
-            );
-        """%{
-            'acstable': acstable.acstable,
-            'columns': ','.join(['%s INTEGER'%i.acstable for i in children]),
-        }
-    
-        query_acs_insert = """
-             INSERT INTO acs_%(acstable)s 
-             VALUES (
-                 %%(geoid)s,
-                 %(children)s
-                )
-        """%{
-            'acstable': acstable.acstable,
-            'children': ','.join(['%%(%s)s'%i.acstable for i in children])
-        }
-    
-        with cityism.config.connect() as conn:
+        with cityism.instrument.stage('load_acs.insert', acstable=acstable.acstable, state=state) as s, cityism.config.connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query_acs_create)    
-                for tract in tracts:
-                    # if len(tract.geoid) < 8:
-                    #    continue
-                    print "%s..."%tract.geoid
-                    print tract.__dict__
-                    cursor.execute(query_acs_insert, tract.data)
+                create_table(cursor, acstable, children)
+                count = insert_tracts(conn, cursor, acstable, children, tracts)
+                s.add(rows=count)
+        print "Loaded %s rows into acs_%s"%(count, acstable.acstable)
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,20 @@
 """Load ACS table definitions."""
 import argparse
+import StringIO
 import cityism.acs
 import cityism.config
+import cityism.instrument
 
 def fix_word_quotes(value):
     return value.decode('windows-1252').encode('ascii', 'ignore')
 
+def iterrows():
+    """Yield (acstable, title, subject) for every table and child."""
+    for key, table in sorted(cityism.acs.ACSMeta.ACSTABLES.items()):
+        yield table.acstable, fix_word_quotes(table.title), table.subject
+        for k, child in sorted(table.children.items()):
+            yield child.acstable, fix_word_quotes(child.title), child.subject
+
 def main():
     parser = argparse.ArgumentParser()
     args = parser.parse_args()
@@ -17,29 +26,22 @@ def main():
             subject VARCHAR
         );
     """
-    
-    query_acsmeta_insert = """
-        INSERT INTO acsmeta 
-        VALUES (%(acstable)s, %(title)s, %(subject)s)
-        ;
-    """
 
-    with cityism.config.connect() as conn:
+    buf = StringIO.StringIO()
+    count = 0
+    for row in iterrows():
+        buf.write('\t'.join(cityism.config.copy_value(i) for i in row))
+        buf.write('\n')
+        count += 1
+    buf.seek(0)
+
+    with cityism.instrument.stage('load_acsmeta.copy') as s, cityism.config.connect() as conn:
         with conn.cursor() as cursor:
             cursor.execute(query_acsmeta_create)
-            for key, table in cityism.acs.ACSMeta.ACSTABLES.items():
-                print "%s..."%table.acstable
-                params = {}
-                params.update(table.data)
-                params['title'] = fix_word_quotes(params['title'])
-                cursor.execute(query_acsmeta_insert, params)
-                for k,child in table.children.items():
-                    print "\t%s"%child.acstable
-                    params = {}
-                    params.update(child.data)
-                    params['title'] = fix_word_quotes(params['title'])
-                    cursor.execute(query_acsmeta_insert, params)
-    
+            cursor.execute("DELETE FROM acsmeta;")
+            cursor.copy_from(buf, 'acsmeta', columns=['acstable', 'title', 'subject'])
+        s.add(rows=count, bytes=buf.len)
+    print "Loaded %s table definitions"%count
 
 if __name__ == "__main__":
     main()
@@ -2,59 +2,111 @@
 
 Data source:
   http://ghdx.healthmetricsandevaluation.org/record/united-states-adult-life-expectancy-state-and-county-1987-2009
+
+All years are kept in a compact NumPy array and loaded with COPY into
+data_life_expectancy_years. The single-year data_life_expectancy table is
+built from it with set-based SQL. If the --tract table exists, the
+county-to-tract broadcast (data_life_expectancy_tract, used by hdi.py) is
+then built in a separate step.
 """
+import argparse
 import csv
 import os
-import sys
+import StringIO
 
-import psycopg2
-import psycopg2.extras
+import numpy
 
 import cityism.config
+import cityism.instrument
+
+DTYPE = [
+    ('fips', 'i4'),
+    ('year', 'i2'),
+    ('le_male', 'f8'),
+    ('le_female', 'f8')
+]
 
 def parse(filename):
-    ret = []
+    """Read all years into a structured array sorted by (fips, year)."""
     with open(filename) as f:
         reader = csv.reader(f)
         header = reader.next()
-        for row in reader:
-            fips = '%05d'%(int(row[0]))
-            state = fips[:2]
-            county = fips[2:5]
-            year = row[3]
-            if year == '2009':
-                print state, county, row[4]
-                # Total life expectancy is mean of male and female
-                le = (float(row[4]) + float(row[5])) / 2
-                row = {
-                    'statefp': state,
-                    'countyfp': county,
-                    'le': le,
-                    'le_male': row[4],
-                    'le_female': row[5]
-                }
-                ret.append(row)
-    return ret
-    
-if __name__ == "__main__":
-    ret = parse(sys.argv[1])
+        rows = [(int(row[0]), int(row[3]), float(row[4]), float(row[5])) for row in reader]
+    data = numpy.array(rows, dtype=DTYPE)
+    data.sort(order=['fips', 'year'])
+    return data
+
+def life_expectancy(data):
+    """Total life expectancy is mean of male and female."""
+    return (data['le_male'] + data['le_female']) / 2
+
+def copy_years(cursor, data):
+    """COPY all years into data_life_expectancy_years."""
+    buf = StringIO.StringIO()
+    le = life_expectancy(data)
+    for row, total in zip(data, le):
+        fips = '%05d'%row['fips']
+        buf.write('%s\t%s\t%d\t%r\t%r\t%r\n'%(fips[:2], fips[2:5], row['year'], float(total), float(row['le_male']), float(row['le_female'])))
+    buf.seek(0)
+    cursor.copy_from(buf, 'data_life_expectancy_years')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="IHME life expectancy CSV")
+    parser.add_argument("--year", help="Year for data_life_expectancy", default=2009, type=int)
+    parser.add_argument("--tract", help="Tract table for the tract broadcast", default="tract")
+    args = parser.parse_args()
+
+    with cityism.instrument.stage('load_lifeexpectancy.parse', filename=args.filename) as s:
+        data = parse(args.filename)
+        s.add(rows=len(data), bytes=os.path.getsize(args.filename))
+    print "Read %s rows, years %s-%s"%(len(data), data['year'].min(), data['year'].max())
+
     query_create = """
-        DROP TABLE IF EXISTS data_life_expectancy;
-        CREATE TABLE data_life_expectancy (
+        DROP TABLE IF EXISTS data_life_expectancy_years;
+        CREATE TABLE data_life_expectancy_years (
               statefp character varying(2),
               countyfp character varying(3),
+              year smallint,
               le float,
               le_male float,
               le_female float,
-              PRIMARY KEY(statefp, countyfp)
+              PRIMARY KEY(statefp, countyfp, year)
           );
     """
-    query_insert = """
-        INSERT INTO data_life_expectancy VALUES (%(statefp)s, %(countyfp)s, %(le)s, %(le_male)s, %(le_female)s);
+    query_year = """
+        DROP TABLE IF EXISTS data_life_expectancy;
+        CREATE TABLE data_life_expectancy AS
+            SELECT statefp, countyfp, le, le_male, le_female
+            FROM data_life_expectancy_years
+            WHERE year = %(year)s;
+        ALTER TABLE data_life_expectancy ADD PRIMARY KEY(statefp, countyfp);
     """
+    query_tract = """
+        DROP TABLE IF EXISTS data_life_expectancy_tract;
+        CREATE TABLE data_life_expectancy_tract AS
+            SELECT tract.geoid, le.le, le.le_male, le.le_female
+            FROM %(tract)s AS tract
+            INNER JOIN data_life_expectancy AS le
+                ON le.statefp = tract.statefp AND le.countyfp = tract.countyfp;
+        ALTER TABLE data_life_expectancy_tract ADD PRIMARY KEY(geoid);
+    """%{'tract': args.tract}
 
     with cityism.config.connect() as conn:
         cur = conn.cursor()
         cur.execute(query_create)
-        for row in ret:
-            cur.execute(query_insert, row)
+        copy_years(cur, data)
+        cur.execute(query_year, {'year': args.year})
+
+    # The broadcast needs TIGER tracts; the county tables do not.
+    with cityism.config.connect() as conn:
+        cur = conn.cursor()
+        cur.execute("""SELECT to_regclass(%s) IS NOT NULL;""", (args.tract,))
+        if not cur.fetchone()[0]:
+            print "Skipping tract broadcast: no table %s"%args.tract
+            return
+        cur.execute(query_tract)
+        print "Built data_life_expectancy_tract from %s"%args.tract
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,203 @@
-"""Load data from LODES employment data into SQL."""
+"""Load data from LODES employment data into SQL.
+
+LODES files are read in chunks and aggregated from blocks to block groups or
+tracts with a NumPy group-by, so memory is bounded by the number of output
+geographies rather than the number of input blocks. Results are bulk loaded
+with COPY. Several files (states, job types) are processed in parallel.
+
+File layouts (the trailing createdate column is ignored):
+  wac: w_geocode, C000, CA01, ...
+  rac: h_geocode, C000, CA01, ...
+  od:  w_geocode, h_geocode, S000, SA01, ...
+"""
 import argparse
 import csv
-import sys
-import collections
+import gzip
+import multiprocessing
+import os
+import StringIO
+
+import numpy
+
 import cityism.config
+import cityism.instrument
+
+# Job type: number of leading geocode columns.
+JOBTYPES = {
+  'wac': 1,
+  'rac': 1,
+  'od': 2
+}
+
+# Geography level: geoid length. Blocks are 15 digits.
+LEVELS = {
+  'block': 15,
+  'bg': 12,
+  'tract': 11
+}
+
+def guess_jobtype(filename):
+  """Guess the job type from a LODES filename, e.g. ca_wac_S000_JT00_2011.csv.gz"""
+  name = os.path.basename(filename).lower()
+  for jobtype in JOBTYPES:
+    if '_%s_'%jobtype in name:
+      return jobtype
+  raise Exception("Unknown LODES job type: %s"%filename)
 
-def parse_lodes(filename, tract=False):
-  ret = {}
-  with open(filename) as f:
+def open_lodes(filename):
+  if filename.endswith('.gz'):
+    return gzip.open(filename)
+  return open(filename)
+
+def read_header(filename, jobtype):
+  """Return the output column names for a LODES file."""
+  with open_lodes(filename) as f:
+    header = csv.reader(f).next()
+  return ['lodes_%s'%i.lower() for i in header[JOBTYPES[jobtype]:-1]]
+
+def iterchunks(filename, jobtype, level='block', chunksize=100000):
+  """Read a LODES file in chunks. Yield (keys, values).
+
+  Keys are geocodes truncated to the geography level; for OD files the
+  work and home geocodes are concatenated. Values is an int64 array with
+  one row per input row.
+  """
+  nkeys = JOBTYPES[jobtype]
+  width = LEVELS[level]
+  keydtype = 'S%d'%(width*nkeys)
+  with open_lodes(filename) as f:
     reader = csv.reader(f)
-    header = reader.next()
-    headers = ['lodes_%s'%i.lower() for i in header[1:-1]]
+    reader.next()
+    keys, values = [], []
     for row in reader:
-      geoid = row[0]
-      data = map(int, row[1:-1])
-      if tract:
-        geoid = geoid[:-4]
-      if geoid not in ret:
-        ret[geoid] = collections.defaultdict(int)
-        ret[geoid]['geoid'] = geoid
-      for k,v in zip(headers, data):
-        ret[geoid][k] += v
-  
-  s = 0
-  for v in sorted(ret.values(), key=lambda x:x.get('lodes_c000')):
-    print v['geoid'], v['lodes_c000']
-    s += v['lodes_c000']
-  print s
-  return ret, sorted(headers)
+      # Truncating each geocode to the level is the aggregation.
+      keys.append(''.join(i[:width] for i in row[:nkeys]))
+      values.append(row[nkeys:-1])
+      if len(keys) >= chunksize:
+        yield numpy.array(keys, dtype=keydtype), numpy.array(values, dtype=numpy.int64)
+        keys, values = [], []
+    if keys:
+      yield numpy.array(keys, dtype=keydtype), numpy.array(values, dtype=numpy.int64)
 
-def main():
-  parser = argparse.ArgumentParser()
-  parser.add_argument("filename", help="filename")
-  parser.add_argument("--tract", help="Aggregate by tract", action="store_true")
-  args = parser.parse_args()
+def groupby(keys, values):
+  """Sum rows of values by key. Return (unique keys, sums)."""
+  uniq, inverse = numpy.unique(keys, return_inverse=True)
+  order = numpy.argsort(inverse, kind='mergesort')
+  starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(inverse[order])) + 1))
+  return uniq, numpy.add.reduceat(values[order], starts, axis=0)
 
-  data, headers = parse_lodes(args.filename, tract=args.tract)
+def merge(parts):
+  """Merge (keys, sums) parts into one, summing repeated keys."""
+  if len(parts) == 1:
+    return parts[0]
+  return groupby(numpy.concatenate([i[0] for i in parts]), numpy.concatenate([i[1] for i in parts]))
 
+def aggregate(filename, jobtype, level='block', chunksize=100000):
+  """Aggregate a LODES file to a geography level. Return (keys, sums)."""
+  acc = None
+  pending, size = [], 0
+  for keys, values in iterchunks(filename, jobtype, level=level, chunksize=chunksize):
+    pending.append(groupby(keys, values))
+    size += len(pending[-1][0])
+    # Merge only once the pending chunks outgrow the accumulator, so each
+    # row is merged O(log chunks) times rather than once per chunk.
+    if acc is None or size >= len(acc[0]):
+      acc = merge(([acc] if acc is not None else []) + pending)
+      pending, size = [], 0
+  if pending:
+    acc = merge([acc] + pending)
+  if acc is None:
+    return None, None
+  return acc
+
+def table_columns(jobtype):
+  if jobtype == 'od':
+    return ['geoid', 'h_geoid']
+  return ['geoid']
+
+def create_table(cursor, table, jobtype, headers):
+  keys = table_columns(jobtype)
   query_lodes_create = """
-    CREATE TABLE IF NOT EXISTS lodes_wac (
-    	geoid VARCHAR NOT NULL PRIMARY KEY,
-        %(columns)s
+    CREATE TABLE IF NOT EXISTS %(table)s (
+      %(keys)s,
+      %(columns)s,
+      PRIMARY KEY (%(pkey)s)
     );
     """%{
+    'table': table,
+    'keys': ','.join(['%s VARCHAR NOT NULL'%i for i in keys]),
     'columns': ','.join(['%s INTEGER'%i for i in headers]),
+    'pkey': ','.join(keys)
   }
+  cursor.execute(query_lodes_create)
 
-  query_lodes_insert = """
-   INSERT INTO lodes_wac
-   VALUES (
-       %%(geoid)s,
-       %(columns)s
-      )
-  """%{
-    'columns': ','.join(['%%(%s)s'%i for i in headers])
-  }
+def copy_rows(cursor, table, jobtype, headers, keys, values, level='block', batch=50000):
+  """COPY aggregated rows into a table."""
+  width = LEVELS[level]
+  columns = table_columns(jobtype) + headers
+  for start in range(0, len(keys), batch):
+    buf = StringIO.StringIO()
+    for key, row in zip(keys[start:start+batch], values[start:start+batch]):
+      geoids = [key[i:i+width] for i in range(0, len(key), width)]
+      buf.write('\t'.join(geoids + [str(i) for i in row]))
+      buf.write('\n')
+    buf.seek(0)
+    cursor.copy_from(buf, table, columns=columns)
+
+def load_file(filename, jobtype=None, level='block', table=None, chunksize=100000):
+  """Aggregate and load one LODES file. Return (filename, rows loaded)."""
+  jobtype = jobtype or guess_jobtype(filename)
+  table = table or 'lodes_%s'%jobtype
+  headers = read_header(filename, jobtype)
+  with cityism.instrument.stage('load_lodes.aggregate', filename=filename, level=level) as s:
+    keys, values = aggregate(filename, jobtype, level=level, chunksize=chunksize)
+    s.add(bytes=os.path.getsize(filename), rows=0 if keys is None else len(keys))
+  if keys is None:
+    return filename, 0
+  with cityism.instrument.stage('load_lodes.copy', filename=filename, table=table) as s:
+    with cityism.config.connect() as conn:
+      with conn.cursor() as cursor:
+        copy_rows(cursor, table, jobtype, headers, keys, values, level=level)
+    s.add(rows=len(keys))
+  return filename, len(keys)
+
+def _load_file(kwargs):
+  return load_file(**kwargs)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("filenames", help="LODES files", nargs='+')
+  parser.add_argument("--jobtype", help="Job type; guessed from filename by default", choices=sorted(JOBTYPES.keys()))
+  parser.add_argument("--level", help="Aggregate to geography level", choices=sorted(LEVELS.keys()), default='block')
+  parser.add_argument("--tract", help="Aggregate by tract", action="store_true")
+  parser.add_argument("--chunksize", help="Rows per chunk", default=100000, type=int)
+  parser.add_argument("--processes", help="Worker processes", default=None, type=int)
+  args = parser.parse_args()
+
+  if args.tract:
+    args.level = 'tract'
+
+  # Create each output table once, before the workers start.
+  tasks = []
+  tables = {}
+  for filename in args.filenames:
+    jobtype = args.jobtype or guess_jobtype(filename)
+    table = 'lodes_%s'%jobtype
+    tables[table] = (jobtype, read_header(filename, jobtype))
+    tasks.append({'filename': filename, 'jobtype': jobtype, 'level': args.level, 'table': table, 'chunksize': args.chunksize})
 
   with cityism.config.connect() as conn:
     with conn.cursor() as cursor:
-      print cursor.execute(query_lodes_create)    
-      for tract in data.values():
-        print "%s..."%tract['geoid']
-        print cursor.execute(query_lodes_insert, tract)
+      for table, (jobtype, headers) in tables.items():
+        create_table(cursor, table, jobtype, headers)
+
+  pool = multiprocessing.Pool(processes=args.processes)
+  try:
+    for filename, count in cityism.instrument.results(pool.imap_unordered(cityism.instrument.Task(_load_file), tasks)):
+      print "%s: %s rows"%(filename, count)
+  finally:
+    pool.close()
+    pool.join()
 
-  
 if __name__ == "__main__":
     main()
-  
\ No newline at end of file
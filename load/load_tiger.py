@@ -1,48 +1,209 @@
-"""Load TIGER shapefiles."""
-import sys
+"""Load TIGER shapefiles.
+
+Shapefile records are read one at a time with ACSShape, encoded as EWKB
+and streamed into PostGIS with binary COPY. Files are loaded concurrently
+into an unindexed staging table in the input SRID. When every file is
+loaded, the geometry is transformed to the output SRID in one statement,
+the staging table replaces the target table, and the spatial and geoid
+indexes, CLUSTER and ANALYZE are run once with maintain.py. A
+<table>_subdivided companion is rebuilt from the new polygons.
+"""
 import argparse
-import subprocess
+import datetime
+import multiprocessing
+import struct
+
+import cityism.acs
+import cityism.config
+import cityism.instrument
+import cityism.maintain
+import cityism.wkb
+
+# Shapefile field types to SQL types.
+FIELDTYPES = {
+    'C': 'VARCHAR',
+    'N': 'BIGINT',
+    'F': 'DOUBLE PRECISION',
+    'D': 'DATE',
+    'L': 'BOOLEAN'
+}
+
+# WKB geometry types to PostGIS type modifiers.
+GEOMTYPES = {
+    cityism.wkb.POINT: 'Point',
+    cityism.wkb.MULTIPOINT: 'MultiPoint',
+    cityism.wkb.MULTILINESTRING: 'MultiLineString',
+    cityism.wkb.MULTIPOLYGON: 'MultiPolygon'
+}
+
+PGCOPY_HEADER = 'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+EPOCH = datetime.date(2000, 1, 1)
 
-def psql_pipe(cmd, database='irees'):
-    psqlcmd = ['psql', '-d', database]
-    print psqlcmd
-    print cmd
-    p1 = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    p2 = subprocess.Popen(psqlcmd, stdin=p1.stdout, stdout=subprocess.PIPE)
-    p1.stdout.close()
-    print p2.communicate()[0]
+def fieldtype(field):
+    """SQL type of a shapefile field: (name, type, size, decimals)."""
+    name, ftype, size, decimals = field
+    if ftype == 'N' and decimals:
+        return FIELDTYPES['F']
+    return FIELDTYPES.get(ftype, 'VARCHAR')
+
+def encode_value(value, sqltype):
+    """Encode a value in PostgreSQL binary COPY format."""
+    if value is None or value == '':
+        return struct.pack('>i', -1)
+    if sqltype == 'BYTEA':
+        data = value
+    elif sqltype == 'BIGINT':
+        data = struct.pack('>q', int(value))
+    elif sqltype == 'DOUBLE PRECISION':
+        data = struct.pack('>d', float(value))
+    elif sqltype == 'BOOLEAN':
+        data = struct.pack('>?', value in (True, 'T', 't', 'Y', 'y'))
+    elif sqltype == 'DATE':
+        if not isinstance(value, datetime.date):
+            return struct.pack('>i', -1)
+        data = struct.pack('>i', (value - EPOCH).days)
+    elif isinstance(value, unicode):
+        data = value.encode('utf-8')
+    else:
+        data = str(value).strip().decode('latin-1').encode('utf-8')
+    return struct.pack('>i', len(data)) + data
+
+class IterFile(object):
+    """File-like object reading from an iterator of strings."""
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.buf = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buf) < size:
+            try:
+                self.buf += self.iterator.next()
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buf)
+        ret, self.buf = self.buf[:size], self.buf[size:]
+        return ret
 
 class ShapeLoader(object):
-    def __init__(self, table, database='irees', srid_in=4269, srid_out=4326):
+    def __init__(self, table, database=None, srid_in=4269, srid_out=4326, processes=None):
         self.database = database
         self.table = table
+        self.staging = '%s_staging'%table
         self.srid_in = srid_in
         self.srid_out = srid_out
-        
+        self.processes = processes
+        self.fields = []
+        self.geomtype = None
+
+    def connect(self):
+        if self.database:
+            return cityism.config.connect(dbname=self.database)
+        return cityism.config.connect()
+
+    def execute(self, query):
+        with self.connect() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+
     def drop_table(self):
-        psql_pipe(["echo", "DROP TABLE %s"%self.table], database=self.database)
-        
+        self.execute("DROP TABLE IF EXISTS %s;"%self.staging)
+
     def create_table(self, filename):
-        cmd = ['shp2pgsql', '-W', 'LATIN1', '-p', '-I', '-s %s:%s'%(self.srid_in, self.srid_out), filename, self.table]
-        psql_pipe(cmd, database=self.database)
-    
+        """Create the staging table from a shapefile's field definitions."""
+        shapes = cityism.acs.ACSShape(filename)
+        self.fields = [(i[0].lower(), fieldtype(i)) for i in shapes.fields()]
+        for rec, shape in shapes.iterrecords():
+            self.geomtype = GEOMTYPES.get(cityism.wkb.SHAPETYPES.get(shape.shapeType))
+            if self.geomtype:
+                break
+        self.execute("""
+            CREATE TABLE %(staging)s (
+                gid SERIAL PRIMARY KEY,
+                %(columns)s,
+                geom geometry(%(geomtype)s, %(srid)s)
+            );
+        """%{
+            'staging': self.staging,
+            'columns': ','.join(['%s %s'%i for i in self.fields]),
+            'geomtype': self.geomtype or 'Geometry',
+            'srid': self.srid_in
+        })
+
+    def iterrows(self, filename):
+        """Yield binary COPY data for a shapefile, one record at a time."""
+        yield PGCOPY_HEADER
+        nfields = struct.pack('>h', len(self.fields)+1)
+        for rec, shape in cityism.acs.ACSShape(filename).iterrecords():
+            row = [nfields]
+            row += [encode_value(v, f[1]) for v, f in zip(rec, self.fields)]
+            geom = cityism.wkb.from_shape(shape, srid=self.srid_in)
+            row.append(encode_value(geom, 'BYTEA'))
+            yield ''.join(row)
+        yield PGCOPY_TRAILER
+
     def load_shp(self, filename):
-        cmd = ['shp2pgsql', '-W', 'LATIN1', '-s %s:%s'%(self.srid_in, self.srid_out), '-a', filename, self.table]
-        psql_pipe(cmd, database=self.database)
+        query = "COPY %s (%s, geom) FROM STDIN WITH (FORMAT binary)"%(self.staging, ','.join(i[0] for i in self.fields))
+        with cityism.instrument.stage('load_tiger.load_shp', filename=filename) as s:
+            with self.connect() as conn:
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(query, IterFile(self.iterrows(filename)))
+                    s.add(rows=cursor.rowcount)
+        return filename
+
+    def load(self, filenames):
+        """Load shapefiles into the staging table in parallel."""
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            for filename in cityism.instrument.results(pool.imap_unordered(cityism.instrument.Task(_load_shp), [(self, i) for i in filenames])):
+                print "Loaded:", filename
+        finally:
+            pool.close()
+            pool.join()
+
+    def finish(self):
+        """Transform to the output SRID and replace the table with staging,
+        then index, cluster and analyze. The spatial index keeps the method
+        of the table it replaces (see maintain.py). Rebuild <table>_subdivided
+        if it exists, so radial queries do not use stale pieces."""
+        params = {'table':self.table, 'staging':self.staging, 'geomtype':self.geomtype or 'Geometry', 'srid':self.srid_out}
+        with cityism.instrument.stage('load_tiger.finish', table=self.table):
+            with self.connect() as conn:
+                with conn.cursor() as cursor:
+                    method = cityism.maintain.index_method(cursor, '%s_geom_idx'%self.table) or 'gist'
+                    cursor.execute("""
+                        ALTER TABLE %(staging)s ALTER COLUMN geom TYPE geometry(%(geomtype)s, %(srid)s) USING ST_Transform(geom, %(srid)s);
+                        DROP TABLE IF EXISTS %(table)s;
+                        ALTER TABLE %(staging)s RENAME TO %(table)s;
+                    """%params)
+                    cityism.maintain.index(cursor, self.table, method=method)
+                    cityism.maintain.cluster(cursor, self.table, method=method)
+                    settings = cityism.maintain.subdivided_settings(cursor, self.table)
+                    if settings:
+                        print "Rebuilding: %s_subdivided"%self.table
+                        cityism.maintain.subdivide(cursor, self.table, **settings)
+
+def _load_shp(args):
+    loader, filename = args
+    return loader.load_shp(filename)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--srid_in", help="Input SRID", default=4269)
-    parser.add_argument("--srid_out", help="Input SRID", default=4326)
+    parser.add_argument("--srid_in", help="Input SRID", default=4269, type=int)
+    parser.add_argument("--srid_out", help="Output SRID", default=4326, type=int)
+    parser.add_argument("--processes", help="Concurrent loads", default=None, type=int)
+    parser.add_argument("--database", help="Database name", default=None)
     parser.add_argument("table", help="Table")
-    parser.add_argument("filenames", help="CSV output file", nargs='*')
-    args = parser.parse_args()    
-    
-    loader = ShapeLoader(table=args.table, srid_in=args.srid_in, srid_out=args.srid_out)    
-    print "Dropping table:", args.table
+    parser.add_argument("filenames", help="Shapefiles", nargs='*')
+    args = parser.parse_args()
+
+    loader = ShapeLoader(table=args.table, database=args.database, srid_in=args.srid_in, srid_out=args.srid_out, processes=args.processes)
+    print "Dropping staging table:", loader.staging
     loader.drop_table()
-    print "Creating table:", args.table
+    print "Creating staging table:", loader.staging
     loader.create_table(args.filenames[0])
-    for filename in args.filenames:
-        print "Loading:", filename
-        loader.load_shp(filename)
\ No newline at end of file
+    loader.load(args.filenames)
+    print "Indexing and clustering:", args.table
+    loader.finish()
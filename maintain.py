@@ -0,0 +1,107 @@
+"""Maintain spatial indexes and layout of geography tables.
+
+For each table:
+  - build a spatial index on geom (GiST, or SP-GiST with PostGIS 2.5+)
+    and a btree index on geoid; a spatial index built with the other
+    method is replaced,
+  - optionally build a <table>_subdivided companion, where polygons with
+    more than --max-vertices vertices are split with ST_Subdivide. Large
+    rural tracts become many small pieces with tight bounding boxes,
+  - CLUSTER on the spatial index and ANALYZE.
+
+QueryRadial uses <level>_subdivided automatically when it exists. The
+subdivide settings are kept as a comment on the companion table, so a TIGER
+reload (load_tiger.py) can rebuild it from the new polygons.
+
+  python maintain.py tract bg --subdivide --max-vertices 256
+
+"""
+import argparse
+
+import cityism.config
+import cityism.instrument
+
+def index_method(cursor, name):
+    """Access method (gist, spgist, btree) of an index, or None if it does
+    not exist."""
+    cursor.execute("""
+        SELECT am.amname FROM pg_class AS c INNER JOIN pg_am AS am ON am.oid = c.relam
+        WHERE c.oid = to_regclass(%s);
+    """, (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def index(cursor, table, method='gist'):
+    """Create the spatial and geoid indexes. A spatial index built with a
+    different method is dropped and rebuilt."""
+    name = '%s_geom_idx'%table
+    current = index_method(cursor, name)
+    if current and current != method:
+        print "Replacing %s index: %s -> %s"%(name, current, method)
+        cursor.execute("""DROP INDEX %s;"""%name)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS %(table)s_geom_idx ON %(table)s USING %(method)s (geom);
+        CREATE INDEX IF NOT EXISTS %(table)s_geoid_idx ON %(table)s (geoid);
+    """%{'table':table, 'method':method})
+
+def cluster(cursor, table, method='gist'):
+    """Cluster on the spatial index and analyze. SP-GiST indexes cannot
+    be clustered on, so those tables are only analyzed."""
+    if method == 'gist':
+        cursor.execute("""CLUSTER %(table)s USING %(table)s_geom_idx;"""%{'table':table})
+    cursor.execute("""ANALYZE %(table)s;"""%{'table':table})
+
+def subdivide(cursor, table, max_vertices=256, method='gist'):
+    """Build <table>_subdivided: (geoid, geom) pieces of each polygon."""
+    subdivided = '%s_subdivided'%table
+    cursor.execute("""
+        DROP TABLE IF EXISTS %(subdivided)s;
+        CREATE TABLE %(subdivided)s AS
+            SELECT geoid, geom FROM %(table)s WHERE ST_NPoints(geom) <= %(max_vertices)d
+            UNION ALL
+            SELECT geoid, ST_Subdivide(geom, %(max_vertices)d) AS geom FROM %(table)s WHERE ST_NPoints(geom) > %(max_vertices)d;
+    """%{'table':table, 'subdivided':subdivided, 'max_vertices':max_vertices})
+    cursor.execute("""COMMENT ON TABLE %(subdivided)s IS 'max_vertices=%(max_vertices)d method=%(method)s';"""%{
+        'subdivided':subdivided, 'max_vertices':max_vertices, 'method':method})
+    index(cursor, subdivided, method=method)
+    cluster(cursor, subdivided, method=method)
+    cursor.execute("""SELECT count(*) FROM %s;"""%subdivided)
+    return cursor.fetchone()[0]
+
+def subdivided_settings(cursor, table):
+    """Settings <table>_subdivided was built with, as subdivide() keyword
+    arguments, or None if there is no companion table."""
+    cursor.execute("""SELECT to_regclass(%s)::oid;""", ('%s_subdivided'%table,))
+    oid = cursor.fetchone()[0]
+    if oid is None:
+        return None
+    cursor.execute("""SELECT obj_description(%s, 'pg_class');""", (oid,))
+    comment = cursor.fetchone()[0] or ''
+    settings = dict(i.split('=', 1) for i in comment.split() if '=' in i)
+    return {
+        'max_vertices': int(settings.get('max_vertices', 256)),
+        'method': settings.get('method', 'gist')
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tables", help="Geography tables, e.g. tract bg", nargs='+')
+    parser.add_argument("--method", help="Spatial index method", choices=['gist', 'spgist'], default='gist')
+    parser.add_argument("--subdivide", help="Build <table>_subdivided companions", action="store_true")
+    parser.add_argument("--max-vertices", help="ST_Subdivide vertex limit", dest="max_vertices", default=256, type=int)
+    args = parser.parse_args()
+
+    for table in args.tables:
+        with cityism.instrument.stage('maintain', table=table) as s, cityism.config.connect() as conn:
+            with conn.cursor() as cursor:
+                print "Indexing: %s"%table
+                index(cursor, table, method=args.method)
+                print "Clustering: %s"%table
+                cluster(cursor, table, method=args.method)
+                if args.subdivide:
+                    count = subdivide(cursor, table, max_vertices=args.max_vertices, method=args.method)
+                    print "Subdivided: %s_subdivided, %s pieces"%(table, count)
+                    s.add(rows=count)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""LODES origin-destination commute flows as a sparse matrix.
+
+Block pairs from LODES OD files are aggregated to tract (or block group)
+pairs and stored as a compressed sparse row matrix: rows are workplace
+geographies, columns are home geographies. The matrix is saved to a
+compressed .npz file and can optionally be loaded into PostGIS.
+
+Row and column lookups answer questions like "where do workers in this
+tract live" without scanning the full flow table, and sum over a set of
+tracts for radial catchments.
+
+Examples:
+
+  python od.py build od_tract.npz ca_od_main_JT00_2011.csv.gz ca_od_aux_JT00_2011.csv.gz
+  python od.py query od_tract.npz 06085500100 --direction home --top 20
+
+"""
+import argparse
+import csv
+import sys
+
+import numpy
+import scipy.sparse
+
+import cityism.config
+import cityism.load.load_lodes
+
+class ODMatrix(object):
+    """Workplace x home flow matrix indexed by geoid."""
+
+    def __init__(self, geoids, matrix, level='tract', column='lodes_s000'):
+        """Geoids is a sorted array of geography IDs; matrix is a square
+        sparse matrix with rows as workplaces and columns as homes."""
+        self.geoids = numpy.asarray(geoids)
+        self.matrix = scipy.sparse.csr_matrix(matrix)
+        self.level = level
+        self.column = column
+        self._csc = None
+
+    @classmethod
+    def from_lodes(cls, filenames, level='tract', column='lodes_s000', chunksize=100000):
+        """Aggregate LODES OD files into a matrix."""
+        width = cityism.load.load_lodes.LEVELS[level]
+        headers = cityism.load.load_lodes.read_header(filenames[0], 'od')
+        index = headers.index(column)
+        keys, values = [], []
+        for filename in filenames:
+            print "Aggregating OD flows: %s"%filename
+            k, v = cityism.load.load_lodes.aggregate(filename, 'od', level=level, chunksize=chunksize)
+            if k is not None:
+                keys.append(k)
+                values.append(v[:,index])
+        keys, values = cityism.load.load_lodes.groupby(numpy.concatenate(keys), numpy.concatenate(values))
+
+        # Keys are work + home geocodes concatenated at a fixed width.
+        pairs = keys.view('S%d'%width).reshape(-1, 2)
+        geoids, inverse = numpy.unique(pairs, return_inverse=True)
+        inverse = inverse.reshape(-1, 2)
+        n = len(geoids)
+        matrix = scipy.sparse.csr_matrix((values, (inverse[:,0], inverse[:,1])), shape=(n, n), dtype=numpy.int64)
+        return cls(geoids, matrix, level=level, column=column)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a matrix saved with save()."""
+        f = numpy.load(filename)
+        matrix = scipy.sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        return cls(f['geoids'], matrix, level=str(f['level']), column=str(f['column']))
+
+    def save(self, filename):
+        """Save to a compressed .npz file."""
+        numpy.savez_compressed(
+            filename,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=self.matrix.shape,
+            geoids=self.geoids,
+            level=self.level,
+            column=self.column
+        )
+
+    def index(self, geoids):
+        """Return matrix indexes for geoids; unknown geoids are dropped."""
+        geoids = numpy.atleast_1d(numpy.asarray(geoids, dtype=self.geoids.dtype))
+        idx = numpy.searchsorted(self.geoids, geoids).clip(0, len(self.geoids)-1)
+        return idx[self.geoids[idx] == geoids]
+
+    def _result(self, vector):
+        vector = numpy.asarray(vector).ravel()
+        nonzero = numpy.flatnonzero(vector)
+        order = nonzero[numpy.argsort(-vector[nonzero], kind='mergesort')]
+        return [(self.geoids[i], int(vector[i])) for i in order]
+
+    def homes(self, geoids):
+        """Where do workers in these geographies live? Return [(geoid, count)]
+        sorted by count. This is a row lookup."""
+        return self._result(self.matrix[self.index(geoids)].sum(axis=0))
+
+    def workplaces(self, geoids):
+        """Where do residents of these geographies work? Return [(geoid,
+        count)] sorted by count. This is a column lookup."""
+        if self._csc is None:
+            self._csc = self.matrix.tocsc()
+        return self._result(self._csc[:,self.index(geoids)].sum(axis=1).T)
+
+    def to_sql(self, table='lodes_od'):
+        """Load the nonzero flows into PostGIS with COPY."""
+        coo = self.matrix.tocoo()
+        keys = numpy.char.add(self.geoids[coo.row], self.geoids[coo.col])
+        with cityism.config.connect() as conn:
+            with conn.cursor() as cursor:
+                cityism.load.load_lodes.create_table(cursor, table, 'od', [self.column])
+                cityism.load.load_lodes.copy_rows(cursor, table, 'od', [self.column], keys, coo.data[:,numpy.newaxis], level=self.level)
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command')
+    build = sub.add_parser('build', help="Build a matrix from LODES OD files")
+    build.add_argument("output", help="Output .npz file")
+    build.add_argument("filenames", help="LODES OD files", nargs='+')
+    build.add_argument("--level", help="Geography level", choices=['bg', 'tract'], default='tract')
+    build.add_argument("--column", help="Flow column", default='lodes_s000')
+    build.add_argument("--table", help="Also load flows into this table")
+    query = sub.add_parser('query', help="Query a matrix")
+    query.add_argument("matrix", help="Matrix .npz file")
+    query.add_argument("geoids", help="Geography IDs", nargs='+')
+    query.add_argument("--direction", help="home: where workers live; work: where residents work", choices=['home', 'work'], default='home')
+    query.add_argument("--top", help="Number of results", default=None, type=int)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        od = ODMatrix.from_lodes(args.filenames, level=args.level, column=args.column)
+        od.save(args.output)
+        print "Saved %s x %s matrix, %s flows: %s"%(od.matrix.shape[0], od.matrix.shape[1], od.matrix.nnz, args.output)
+        if args.table:
+            od.to_sql(table=args.table)
+    else:
+        od = ODMatrix.load(args.matrix)
+        if args.direction == 'home':
+            result = od.homes(args.geoids)
+        else:
+            result = od.workplaces(args.geoids)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['geoid', od.column])
+        for row in result[:args.top]:
+            writer.writerow(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""Query base class."""
+
+class Query(object):
+    """A query run against an open database connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def query(self, **kwargs):
+        raise NotImplementedError
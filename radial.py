@@ -4,25 +4,54 @@ import argparse
 import csv
 import sys
 
-import acs
-import config
-import query
+import psycopg2
 
-class QueryRadial(query.Query):
-    def query(self, lon=None, lat=None, acstable='B25034', radius_inner=0, radius_outer=1000, density=True, level='tract'):
-        query = """
-            WITH
+import cityism.acs
+import cityism.config
+import cityism.geodesic
+import cityism.instrument
+import cityism.query
+
+class QueryRadial(cityism.query.Query):
+    def sql(self, acstable, level, subdivided=False):
+        """Radial query for a prepared statement: $1 is the annulus as
+        EWKB (SRID 4326; see geodesic.annuli). Areas are geodesic, on the
+        geography type. With subdivided, intersections are computed
+        against the pieces in <level>_subdivided."""
+        cupcake = """
                 cupcake AS ( SELECT
-                    utmzone(ST_SetSRID(ST_MakePoint(%%(lon)s, %%(lat)s), 4326)) AS srid,
-                    ST_Difference(
-                            ST_Buffer_Meters(ST_SetSRID(ST_MakePoint(%%(lon)s, %%(lat)s), 4326), %%(radius_outer)s),
-                            ST_Buffer_Meters(ST_SetSRID(ST_MakePoint(%%(lon)s, %%(lat)s), 4326), %%(radius_inner)s)
-                    ) AS donut
+                    ST_GeomFromEWKB($1) AS donut
+                )"""
+        if subdivided:
+            return """
+            WITH
+                %(cupcake)s,
+                pieces AS ( SELECT
+                    sub.geoid,
+                    SUM(ST_Area(ST_Intersection(sub.geom, cupcake.donut)::geography)) AS area_intersect
+                    FROM cupcake, %(level)s_subdivided AS sub
+                    WHERE ST_Intersects(sub.geom, cupcake.donut)
+                    GROUP BY sub.geoid
                 )
+            SELECT
+                pieces.geoid,
+                pieces.area_intersect,
+                ST_Area(geo.geom::geography) AS area_tract,
+                acs_%(acstable)s.*
+            FROM
+                pieces
+            INNER JOIN
+                %(level)s AS geo ON geo.geoid = pieces.geoid
+            INNER JOIN
+                acs_%(acstable)s ON pieces.geoid = acs_%(acstable)s.geoid
+            """%{'cupcake':cupcake, 'acstable':acstable, 'level':level}
+        return """
+            WITH
+                %(cupcake)s
             SELECT
                 geo.geoid,
-                ST_Area(ST_Transform(ST_Intersection(geo.geom, cupcake.donut), cupcake.srid)) AS area_intersect,
-                ST_Area(ST_Transform(geo.geom, cupcake.srid)) AS area_tract,
+                ST_Area(ST_Intersection(geo.geom, cupcake.donut)::geography) AS area_intersect,
+                ST_Area(geo.geom::geography) AS area_tract,
                 acs_%(acstable)s.*
             FROM
                 cupcake,
@@ -33,10 +62,27 @@ class QueryRadial(query.Query):
                 ST_Intersects(
                     geo.geom,
                     cupcake.donut
-                );
-        """%{'acstable':acstable, 'level':level}
+                )
+        """%{'cupcake':cupcake, 'acstable':acstable, 'level':level}
+
+    def subdivided(self, level):
+        """Does a <level>_subdivided companion table exist? (See maintain.py)"""
+        with self.conn.cursor() as cursor:
+            cursor.execute("""SELECT to_regclass(%s) IS NOT NULL;""", ('%s_subdivided'%level,))
+            return cursor.fetchone()[0]
 
-        if lon is None or lat is None:
+    def prepare(self, acstable, level):
+        """Prepare the radial query on this connection, once."""
+        name = ('radial_%s_%s'%(acstable, level)).lower()
+        if name not in getattr(self.conn, 'prepared', ()):
+            query = self.sql(acstable, level, subdivided=self.subdivided(level))
+            cityism.config.prepare(self.conn, name, query, types=['bytea'])
+        return name
+
+    def query(self, lon=None, lat=None, acstable='B25034', radius_inner=0, radius_outer=1000, density=True, level='tract', vertices=64, donut=None):
+        """Sum (or density of) an ACS table over an annulus. Pass donut
+        (EWKB from geodesic.annuli) to reuse precomputed rings."""
+        if donut is None and (lon is None or lat is None):
             raise Exception("Need lon, lat.")
 
         if not acstable:
@@ -48,20 +94,30 @@ class QueryRadial(query.Query):
             raise Exception("Max 100km.")
         if radius_inner < 0:
             raise Exception("Min 0km.")
+        if radius_inner == radius_outer:
+            # Empty annulus.
+            return []
 
         plot = []
         data = []
         area = 0
-        params = {'radius_outer':radius_outer, 'radius_inner':radius_inner, 'lon':lon, 'lat':lat}
-        with self.conn.cursor() as cursor:
-            cursor.execute(query, params)
-            for row in cursor:
-                pct = row[1] / row[2]
-                data.append([i*pct for i in row[4:]])
-                area += row[1]
+        if donut is None:
+            donut = cityism.geodesic.annuli(lon, lat, [radius_inner, radius_outer], vertices=vertices)[0]
+        params = (psycopg2.Binary(donut),)
+        name = self.prepare(acstable, level)
+        execute = "EXECUTE %s (%%s)"%name
+        with cityism.instrument.stage('radial.query', acstable=acstable, level=level, radius_outer=radius_outer) as s:
+            with self.conn.cursor() as cursor:
+                cityism.instrument.explain(cursor, execute, params, name='radial.explain')
+                cursor.execute(execute, params)
+                for row in cursor:
+                    pct = row[1] / row[2]
+                    data.append([i*pct for i in row[4:]])
+                    area += row[1]
+            s.add(rows=len(data))
 
-        # The buffers are not perfect circles, so sum of intersected area
-        #     will be slightly less than expected.
+        # The rings are polygons with a finite number of vertices, so sum
+        #     of intersected area will be slightly less than expected.
         # print "Total area?", area, "expected:", math.pi*(radius_outer)**2 - math.pi*(radius_inner)**2
         plot = []
         for count, i in enumerate(zip(*data)):
@@ -80,16 +136,22 @@ if __name__ == "__main__":
     parser.add_argument("--start", type=int, default=1000)
     parser.add_argument("--end", type=int, default=50000)
     parser.add_argument("--width", type=int, default=1000)
+    parser.add_argument("--vertices", help="Vertices per geodesic ring", type=int, default=64)
     args = parser.parse_args()
 
+    # All rings are computed at once, before querying.
+    radii = range(args.start, args.end, args.width)
+    radii.append(radii[-1]+args.width)
+    donuts = cityism.geodesic.annuli(args.lon, args.lat, radii, vertices=args.vertices)
+
     plots = []
-    with config.connect() as conn:
-        for radius in range(args.start, args.end, args.width):
-            plot = QueryRadial(conn=conn).query(acstable=args.acstable, radius_inner=radius, radius_outer=radius+args.width, level=args.level, lon=args.lon, lat=args.lat)
+    with cityism.config.pooled() as conn:
+        for radius, donut in zip(radii, donuts):
+            plot = QueryRadial(conn=conn).query(acstable=args.acstable, radius_inner=radius, radius_outer=radius+args.width, level=args.level, lon=args.lon, lat=args.lat, donut=donut)
             plots.append(plot)
 
     # Ugly, dirty csv. Fix me.
-    params = acs.ACSMeta.get(args.acstable).getchildren()
+    params = cityism.acs.ACSMeta.get(args.acstable).getchildren()
     writer = csv.writer(sys.stdout)
     writer.writerow(['Radial distribution query:'])
     writer.writerow(['lon',args.lon])
@@ -0,0 +1,19 @@
+"""Checks for COPY text escaping."""
+import unittest
+
+import cityism.config
+
+class TestCopyValue(unittest.TestCase):
+    def test_null(self):
+        self.assertEqual(cityism.config.copy_value(None), '\\N')
+
+    def test_escapes(self):
+        self.assertEqual(cityism.config.copy_value('a\\b\tc\nd\re'), 'a\\\\b\\tc\\nd\\re')
+
+    def test_values(self):
+        self.assertEqual(cityism.config.copy_value(12), '12')
+        self.assertEqual(cityism.config.copy_value(''), '')
+        self.assertEqual(cityism.config.copy_value(u'Do\xf1a Ana'), 'Do\xc3\xb1a Ana')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Checks for geodesic rings."""
+import unittest
+
+import numpy
+
+import cityism.geodesic as geodesic
+import cityism.wkb
+
+def dms(d, m, s):
+    sign = -1 if d < 0 else 1
+    return sign * (abs(d) + m / 60.0 + s / 3600.0)
+
+class TestDirect(unittest.TestCase):
+    def test_flinders_peak(self):
+        # Vincenty (1975): Flinders Peak to Buninyong.
+        lon, lat = geodesic.direct(dms(144, 25, 29.52440), dms(-37, 57, 3.72030), dms(306, 52, 5.37), 54972.271)
+        self.assertAlmostEqual(float(lon), dms(143, 55, 35.38390), delta=1e-8)
+        self.assertAlmostEqual(float(lat), dms(-37, 39, 10.15610), delta=1e-8)
+
+    def test_equator(self):
+        # One degree of longitude along the equator.
+        lon, lat = geodesic.direct(0.0, 0.0, 90.0, 111319.49079327357)
+        self.assertAlmostEqual(float(lon), 1.0, places=9)
+        self.assertAlmostEqual(float(lat), 0.0, places=9)
+
+    def test_broadcast(self):
+        lon, lat = geodesic.direct([0.0, 10.0], [0.0, 20.0], 0.0, [0.0, 1000.0])
+        self.assertEqual(lon.shape, (2,))
+        self.assertAlmostEqual(lon[0], 0.0)
+        self.assertAlmostEqual(lat[0], 0.0)
+        self.assertTrue(lat[1] > 20.0)
+
+class TestRings(unittest.TestCase):
+    def test_circles(self):
+        rings = geodesic.circles([-121.89, -73.99], [37.33, 40.73], [500, 1000, 2000], vertices=16)
+        self.assertEqual(rings.shape, (2, 3, 17, 2))
+        # Closed and counter-clockwise.
+        self.assertTrue(numpy.all(rings[:, :, 0] == rings[:, :, -1]))
+        self.assertTrue(cityism.wkb.ring_area(rings[0, 0].tolist()) > 0)
+
+    def test_annuli(self):
+        donuts = geodesic.annuli(-121.89, 37.33, [0, 1000, 2000], vertices=8)
+        self.assertEqual(len(donuts), 2)
+        # Disc: header, 1 ring of 9 points. Annulus: 2 rings.
+        self.assertEqual(len(donuts[0]), 9 + 4 + 4 + 9 * 16)
+        self.assertEqual(len(donuts[1]), 9 + 4 + 2 * (4 + 9 * 16))
+
+    def test_annuli_empty(self):
+        self.assertRaises(Exception, geodesic.annuli, -121.89, 37.33, [1000, 1000])
+        self.assertRaises(Exception, geodesic.annuli, -121.89, 37.33, [2000, 1000])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Checks for LODES aggregation."""
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import cityism.load.load_lodes as load_lodes
+
+class TestGroupby(unittest.TestCase):
+    def test_groupby(self):
+        keys = numpy.array(['b', 'a', 'b', 'c', 'a'])
+        values = numpy.array([[1, 2], [3, 4], [5, 6], [7, 8], [9, 10]])
+        uniq, sums = load_lodes.groupby(keys, values)
+        self.assertEqual(list(uniq), ['a', 'b', 'c'])
+        self.assertEqual(sums.tolist(), [[12, 14], [6, 8], [7, 8]])
+
+    def test_merge(self):
+        parts = [
+            load_lodes.groupby(numpy.array(['a', 'b']), numpy.array([[1], [2]])),
+            load_lodes.groupby(numpy.array(['b', 'c', 'b']), numpy.array([[3], [4], [5]]))
+        ]
+        uniq, sums = load_lodes.merge(parts)
+        self.assertEqual(list(uniq), ['a', 'b', 'c'])
+        self.assertEqual(sums.tolist(), [[1], [10], [4]])
+
+class TestAggregate(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workdir, 'ca_wac_S000_JT00_2011.csv')
+        blocks = ['060014001001000', '060014001001001', '060014002001000', '060014001002000']
+        self.rows = []
+        with open(self.filename, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['w_geocode', 'C000', 'CA01', 'createdate'])
+            for i in range(103):
+                row = [blocks[i % len(blocks)], i, i % 3, '20130101']
+                writer.writerow(row)
+                self.rows.append(row)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def expected(self, width):
+        ret = {}
+        for row in self.rows:
+            key = row[0][:width]
+            total = ret.setdefault(key, [0, 0])
+            total[0] += row[1]
+            total[1] += row[2]
+        return ret
+
+    def test_duplicate_keys_across_chunks(self):
+        for level in ('block', 'tract'):
+            for chunksize in (1, 7, 1000):
+                keys, sums = load_lodes.aggregate(self.filename, 'wac', level=level, chunksize=chunksize)
+                self.assertEqual(dict(zip(keys, sums.tolist())), self.expected(load_lodes.LEVELS[level]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Checks for binary COPY encoding."""
+import datetime
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import cityism.acs
+import cityism.load.load_tiger as load_tiger
+
+def write_counties(filename):
+    """Write a Latin-1 county shapefile, as TIGER distributes them."""
+    import shapefile
+    w = shapefile.Writer(filename, shapeType=shapefile.POLYGON, encoding='latin1')
+    w.field('GEOID', 'C', 5)
+    w.field('NAME', 'C', 100)
+    w.field('ALAND', 'N', 14, 0)
+    w.poly([[[-107.0, 32.0], [-107.0, 33.0], [-106.0, 33.0], [-106.0, 32.0], [-107.0, 32.0]]])
+    w.record('35013', u'Do\xf1a Ana', 9860815403)
+    w.close()
+
+class TestEncodeValue(unittest.TestCase):
+    def test_null(self):
+        for sqltype in ('VARCHAR', 'BIGINT', 'DOUBLE PRECISION', 'BYTEA'):
+            self.assertEqual(load_tiger.encode_value(None, sqltype), '\xff\xff\xff\xff')
+            self.assertEqual(load_tiger.encode_value('', sqltype), '\xff\xff\xff\xff')
+
+    def test_bigint(self):
+        self.assertEqual(load_tiger.encode_value('1234', 'BIGINT'), struct.pack('>iq', 8, 1234))
+
+    def test_double(self):
+        self.assertEqual(load_tiger.encode_value(1.5, 'DOUBLE PRECISION'), struct.pack('>id', 8, 1.5))
+
+    def test_boolean(self):
+        self.assertEqual(load_tiger.encode_value('T', 'BOOLEAN'), '\x00\x00\x00\x01\x01')
+        self.assertEqual(load_tiger.encode_value('F', 'BOOLEAN'), '\x00\x00\x00\x01\x00')
+
+    def test_date(self):
+        self.assertEqual(load_tiger.encode_value(datetime.date(2000, 1, 2), 'DATE'), struct.pack('>ii', 4, 1))
+        self.assertEqual(load_tiger.encode_value('20000102', 'DATE'), '\xff\xff\xff\xff')
+
+    def test_varchar(self):
+        workdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(workdir, 'counties')
+            write_counties(filename)
+            rec, shape = cityism.acs.ACSShape(filename).iterrecords().next()
+            self.assertEqual(load_tiger.encode_value(rec[1], 'VARCHAR'), '\x00\x00\x00\x09Do\xc3\xb1a Ana')
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_bytea_untouched(self):
+        data = '\x01\x00\xff\t\n\\'
+        self.assertEqual(load_tiger.encode_value(data, 'BYTEA'), struct.pack('>i', len(data)) + data)
+
+class TestIterRows(unittest.TestCase):
+    def test_latin1_shapefile(self):
+        workdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(workdir, 'counties')
+            write_counties(filename)
+            # Without a database: set up the loader state create_table() would.
+            loader = load_tiger.ShapeLoader.__new__(load_tiger.ShapeLoader)
+            loader.srid_in = 4269
+            loader.fields = [(i[0].lower(), load_tiger.fieldtype(i)) for i in cityism.acs.ACSShape(filename).fields()]
+            data = ''.join(loader.iterrows(filename))
+        finally:
+            shutil.rmtree(workdir)
+        self.assertTrue(data.startswith(load_tiger.PGCOPY_HEADER))
+        self.assertTrue(data.endswith(load_tiger.PGCOPY_TRAILER))
+        self.assertTrue('Do\xc3\xb1a Ana' in data)
+
+class TestIterFile(unittest.TestCase):
+    def test_read(self):
+        parts = [load_tiger.PGCOPY_HEADER, 'abc', '', 'defghij', load_tiger.PGCOPY_TRAILER]
+        expected = ''.join(parts)
+        for size in (1, 3, 5, 64, -1):
+            f = load_tiger.IterFile(iter(parts))
+            chunks = []
+            while True:
+                data = f.read(size)
+                if not data:
+                    break
+                if size > 0:
+                    self.assertTrue(len(data) <= size)
+                chunks.append(data)
+            self.assertEqual(''.join(chunks), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Checks for EWKB encoding of shapefile geometry."""
+import binascii
+import struct
+import unittest
+
+import cityism.wkb as wkb
+
+class Shape(object):
+    """Stand-in for a pyshp shape."""
+    def __init__(self, shapeType, points, parts=(0,)):
+        self.shapeType = shapeType
+        self.points = points
+        self.parts = list(parts)
+
+def decode(data):
+    """Decode little-endian (E)WKB into (type, srid, coordinates)."""
+    def read(fmt, offset):
+        return struct.unpack_from(fmt, data, offset), offset + struct.calcsize(fmt)
+    def geometry(offset):
+        (order, wkbtype), offset = read('<BI', offset)
+        assert order == 1
+        srid = None
+        if wkbtype & wkb.SRID_FLAG:
+            (srid,), offset = read('<I', offset)
+            wkbtype &= ~wkb.SRID_FLAG
+        if wkbtype == wkb.POINT:
+            coords, offset = read('<dd', offset)
+        elif wkbtype == wkb.LINESTRING:
+            coords, offset = points(offset)
+        elif wkbtype == wkb.POLYGON:
+            (n,), offset = read('<I', offset)
+            coords = []
+            for i in range(n):
+                ring, offset = points(offset)
+                coords.append(ring)
+        else:
+            (n,), offset = read('<I', offset)
+            coords = []
+            for i in range(n):
+                part, offset = geometry(offset)
+                coords.append(part)
+        return (wkbtype, srid, coords), offset
+    def points(offset):
+        (n,), offset = read('<I', offset)
+        ret = []
+        for i in range(n):
+            p, offset = read('<dd', offset)
+            ret.append(p)
+        return ret, offset
+    ret, offset = geometry(0)
+    assert offset == len(data)
+    return ret
+
+class TestWKB(unittest.TestCase):
+    def test_point_hex(self):
+        data = wkb.from_shape(Shape(1, [(1.0, 2.0)]), srid=4326)
+        self.assertEqual(binascii.hexlify(data).upper(), '0101000020E6100000000000000000F03F0000000000000040')
+
+    def test_point_no_srid(self):
+        self.assertEqual(binascii.hexlify(wkb.point(1.0, 2.0)).upper(), '0101000000000000000000F03F0000000000000040')
+
+    def test_null_shape(self):
+        self.assertEqual(wkb.from_shape(Shape(0, [])), None)
+        self.assertEqual(wkb.from_shape(Shape(5, [])), None)
+
+    def test_polygon_with_hole(self):
+        # Shapefile order: exterior clockwise, then a counter-clockwise hole;
+        # then a second, separate exterior.
+        exterior = [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)]
+        hole = [(2, 2), (4, 2), (4, 4), (2, 4), (2, 2)]
+        other = [(20, 0), (20, 1), (21, 1), (21, 0), (20, 0)]
+        shape = Shape(5, exterior + hole + other, parts=(0, 5, 10))
+        wkbtype, srid, polygons = decode(wkb.from_shape(shape, srid=4269))
+        self.assertEqual((wkbtype, srid), (wkb.MULTIPOLYGON, 4269))
+        self.assertEqual(len(polygons), 2)
+        self.assertEqual(polygons[0], (wkb.POLYGON, None, [[tuple(map(float, p)) for p in exterior], [tuple(map(float, p)) for p in hole]]))
+        self.assertEqual(polygons[1], (wkb.POLYGON, None, [[tuple(map(float, p)) for p in other]]))
+
+    def test_polyline(self):
+        shape = Shape(3, [(0, 0), (1, 1), (5, 5), (6, 7), (8, 9)], parts=(0, 2))
+        wkbtype, srid, lines = decode(wkb.from_shape(shape))
+        self.assertEqual((wkbtype, srid), (wkb.MULTILINESTRING, None))
+        self.assertEqual([len(i[2]) for i in lines], [2, 3])
+
+    def test_ring_area(self):
+        self.assertEqual(wkb.ring_area([(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]), 1.0)
+        self.assertEqual(wkb.ring_area([(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]), -1.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,298 @@
+"""Build Mapbox Vector Tiles for Census geography into an MBTiles file.
+
+Tiles are rendered by PostGIS (ST_AsMVT) in parallel, one tile per task, and
+written to a single sqlite MBTiles file. Geometry is simplified for each zoom
+level before clipping.
+
+Each build records a digest and bounding box for every source tract. A
+later build with --update only re-renders the tiles that intersect tracts
+that were added, removed, or changed since.
+
+Example:
+
+  python tiles.py tracts.mbtiles --state 06 --minzoom 4 --maxzoom 12 --join acs_b01001:b01001_001 --join lodes_wac:lodes_c000
+
+"""
+import argparse
+import gzip
+import json
+import math
+import multiprocessing
+import sqlite3
+import StringIO
+
+import psycopg2
+
+import cityism.config
+import cityism.export
+import cityism.instrument
+
+# Web Mercator half-width, meters.
+MERCATOR = 20037508.342789244
+EXTENT = 4096
+BUFFER = 64
+
+##### Tile math #####
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Return the x, y (XYZ scheme) tile containing lon, lat."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(math.radians(lat)) + 1.0 / math.cos(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n-1), min(max(y, 0), n-1)
+
+def tile_bounds(zoom, x, y):
+    """Web Mercator bounds of a tile: (xmin, ymin, xmax, ymax)."""
+    size = 2 * MERCATOR / (2 ** zoom)
+    xmin = -MERCATOR + x * size
+    ymax = MERCATOR - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+def tiles_for_bbox(bbox, zoom):
+    """All tiles at zoom covering a lon/lat bbox (xmin, ymin, xmax, ymax)."""
+    x0, y0 = lonlat_to_tile(bbox[0], bbox[3], zoom)
+    x1, y1 = lonlat_to_tile(bbox[2], bbox[1], zoom)
+    for x in range(x0, x1+1):
+        for y in range(y0, y1+1):
+            yield zoom, x, y
+
+def tolerance(zoom):
+    """Simplification tolerance (meters) at a zoom: about one tile pixel."""
+    return 2 * MERCATOR / (2 ** zoom) / EXTENT
+
+##### Queries #####
+
+def build_query(table='tract', joins=None, state=None, layer='tracts', srid=4326):
+    """Build the tile query. Parameters are the tile bounds and tolerance.
+    srid is the SRID of the geography table, so the tile envelope is
+    transformed once per tile and the spatial index can be used."""
+    joincolumns, join_clauses = cityism.export.build_joins(joins)
+    columns = ['geo.geoid'] + joincolumns
+    where = ''
+    if state:
+        where = "AND geo.statefp = '%s'"%state.replace("'", "")
+    return """
+        WITH
+            bounds AS ( SELECT ST_MakeEnvelope(%%(xmin)s, %%(ymin)s, %%(xmax)s, %%(ymax)s, 3857) AS geom ),
+            mvtgeom AS (
+                SELECT
+                    ST_AsMVTGeom(
+                        ST_SimplifyPreserveTopology(ST_Transform(geo.geom, 3857), %%(tolerance)s),
+                        bounds.geom, %(extent)s, %(buffer)s, true
+                    ) AS geom,
+                    %(columns)s
+                FROM
+                    bounds,
+                    %(table)s AS geo
+                %(joins)s
+                WHERE
+                    geo.geom && ST_Transform(ST_MakeEnvelope(%%(xmin)s, %%(ymin)s, %%(xmax)s, %%(ymax)s, 3857), %(srid)d)
+                    %(where)s
+            )
+        SELECT ST_AsMVT(mvtgeom.*, '%(layer)s', %(extent)s, 'geom') FROM mvtgeom WHERE geom IS NOT NULL;
+    """%{
+        'columns': ', '.join(columns),
+        'table': table,
+        'joins': join_clauses,
+        'where': where,
+        'layer': layer,
+        'srid': srid,
+        'extent': EXTENT,
+        'buffer': BUFFER
+    }
+
+def build_digest_query(table='tract', joins=None, state=None):
+    """Per-tract digest of geometry and joined values, with lon/lat bbox."""
+    joincolumns, join_clauses = cityism.export.build_joins(joins)
+    values = ['ST_AsEWKB(geo.geom)::text'] + ['%s::text'%i for i in joincolumns]
+    where = ''
+    if state:
+        where = "WHERE geo.statefp = '%s'"%state.replace("'", "")
+    return """
+        SELECT
+            geo.geoid,
+            md5(concat_ws('|', %(values)s)),
+            ST_XMin(b), ST_YMin(b), ST_XMax(b), ST_YMax(b)
+        FROM
+            (SELECT geo.*, ST_Transform(geo.geom, 4326)::box2d AS b FROM %(table)s AS geo) AS geo
+        %(joins)s
+        %(where)s;
+    """%{
+        'values': ', '.join(values),
+        'table': table,
+        'joins': join_clauses,
+        'where': where
+    }
+
+def table_srid(cursor, table):
+    """SRID of a geography table's geom column."""
+    cursor.execute("""SELECT ST_SRID(geom) FROM %s LIMIT 1;"""%table)
+    row = cursor.fetchone()
+    return row[0] if row else 4326
+
+def layer_fields(cursor, table='tract', joins=None):
+    """Tile attribute names and types (String or Number) for a vector_layers entry."""
+    joincolumns, join_clauses = cityism.export.build_joins(joins)
+    cursor.execute("""SELECT %s FROM %s AS geo %s LIMIT 0;"""%(', '.join(['geo.geoid'] + joincolumns), table, join_clauses))
+    return dict((i[0], 'Number' if i[1] in psycopg2.NUMBER.values else 'String') for i in cursor.description)
+
+def union_bbox(bboxes):
+    """lon/lat bbox covering all bboxes, clamped to the Web Mercator range."""
+    if not bboxes:
+        return -180.0, -85.0511, 180.0, 85.0511
+    return (
+        max(min(i[0] for i in bboxes), -180.0),
+        max(min(i[1] for i in bboxes), -85.0511),
+        min(max(i[2] for i in bboxes), 180.0),
+        min(max(i[3] for i in bboxes), 85.0511)
+    )
+
+##### MBTiles #####
+
+class MBTiles(object):
+    """Minimal MBTiles writer, with a digest table for incremental builds."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+            CREATE TABLE IF NOT EXISTS source_digest (geoid TEXT PRIMARY KEY, digest TEXT, xmin REAL, ymin REAL, xmax REAL, ymax REAL);
+        """)
+
+    def set_metadata(self, **kwargs):
+        for k,v in kwargs.items():
+            self.db.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?)", (k, str(v)))
+
+    def put(self, zoom, x, y, data):
+        """Store a tile (XYZ scheme); an empty tile removes any existing one."""
+        row = (2 ** zoom) - 1 - y # MBTiles uses TMS row numbering.
+        if not data:
+            self.db.execute("DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?", (zoom, x, row))
+            return
+        self.db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (zoom, x, row, sqlite3.Binary(data)))
+
+    def digests(self):
+        return dict((i[0], (i[1], i[2:])) for i in self.db.execute("SELECT * FROM source_digest"))
+
+    def set_digests(self, digests):
+        self.db.execute("DELETE FROM source_digest")
+        self.db.executemany("INSERT INTO source_digest VALUES (?, ?, ?, ?, ?, ?)", [(k, v[0])+tuple(v[1]) for k,v in digests.items()])
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+##### Workers #####
+
+_worker = {}
+
+def _init_worker(query):
+    """Open one database connection per worker process."""
+    _worker['conn'] = cityism.config.connect()
+    _worker['query'] = query
+
+def _render(tile):
+    zoom, x, y = tile
+    xmin, ymin, xmax, ymax = tile_bounds(zoom, x, y)
+    params = {'xmin':xmin, 'ymin':ymin, 'xmax':xmax, 'ymax':ymax, 'tolerance':tolerance(zoom)}
+    with _worker['conn'].cursor() as cursor:
+        cursor.execute(_worker['query'], params)
+        data = str(cursor.fetchone()[0] or '')
+    _worker['conn'].rollback()
+    if data:
+        # MBTiles vector tiles are stored gzip-compressed.
+        buf = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(data)
+        data = buf.getvalue()
+    return tile, data
+
+##### Build #####
+
+def changed_bboxes(old, new):
+    """Bounding boxes of tracts that were added, removed, or changed."""
+    ret = []
+    for geoid, (digest, bbox) in new.items():
+        if geoid not in old or old[geoid][0] != digest:
+            ret.append(bbox)
+            if geoid in old:
+                ret.append(old[geoid][1])
+    for geoid, (digest, bbox) in old.items():
+        if geoid not in new:
+            ret.append(bbox)
+    return ret
+
+def build(filename, table='tract', joins=None, state=None, minzoom=4, maxzoom=12, layer='tracts', update=False, processes=None):
+    """Render tiles into an MBTiles file. Return the number of tiles rendered."""
+    mbtiles = MBTiles(filename)
+    with cityism.config.connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(build_digest_query(table=table, joins=joins, state=state))
+            digests = dict((i[0], (i[1], i[2:])) for i in cursor)
+            srid = table_srid(cursor, table)
+            fields = layer_fields(cursor, table=table, joins=joins)
+
+    if update:
+        bboxes = changed_bboxes(mbtiles.digests(), digests)
+    else:
+        bboxes = [v[1] for v in digests.values()]
+
+    tiles = set()
+    for zoom in range(minzoom, maxzoom+1):
+        for bbox in bboxes:
+            tiles.update(tiles_for_bbox(bbox, zoom))
+    print "Rendering %s tiles"%len(tiles)
+
+    query = build_query(table=table, joins=joins, state=state, layer=layer, srid=srid)
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(query,))
+    count = 0
+    try:
+        for tile, data in cityism.instrument.results(pool.imap_unordered(cityism.instrument.Task(_render), sorted(tiles), chunksize=16)):
+            mbtiles.put(*tile, data=data)
+            count += 1
+            if count % 1000 == 0:
+                print "%s tiles..."%count
+                mbtiles.commit()
+    finally:
+        pool.close()
+        pool.join()
+
+    mbtiles.set_digests(digests)
+    # MBTiles 1.3: vector tilesets need a json row describing their layers.
+    vector_layers = [{'id': layer, 'fields': fields, 'minzoom': minzoom, 'maxzoom': maxzoom}]
+    mbtiles.set_metadata(
+        name=layer,
+        format='pbf',
+        minzoom=minzoom,
+        maxzoom=maxzoom,
+        bounds=','.join('%0.6f'%i for i in union_bbox([v[1] for v in digests.values()])),
+        json=json.dumps({'vector_layers': vector_layers})
+    )
+    mbtiles.close()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="MBTiles output file")
+    parser.add_argument("--table", help="Geography table", default="tract")
+    parser.add_argument("--state", help="State FIPS code, e.g. 06")
+    parser.add_argument("--join", help="Join table and columns, e.g. lodes_wac:lodes_c000", type=cityism.export.parse_join, action="append", default=[])
+    parser.add_argument("--layer", help="Layer name", default="tracts")
+    parser.add_argument("--minzoom", help="Minimum zoom", default=4, type=int)
+    parser.add_argument("--maxzoom", help="Maximum zoom", default=12, type=int)
+    parser.add_argument("--processes", help="Worker processes", default=None, type=int)
+    parser.add_argument("--update", help="Only rebuild tiles for changed tracts", action="store_true")
+    args = parser.parse_args()
+
+    count = build(args.filename, table=args.table, joins=args.join, state=args.state, minzoom=args.minzoom, maxzoom=args.maxzoom, layer=args.layer, update=args.update, processes=args.processes)
+    print "Rendered %s tiles"%count
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Multi-year ACS time series.
+
+Each ACS release (year, span, state) of a table is parsed once into a
+columnar cache: an .npz file holding a sorted geoid array and a float64
+values matrix, one column per child table, NaN where the estimate is
+missing. Later runs read the cache instead of the summary files.
+
+Releases are stored in acs_ts_<table>, a table partitioned by LIST (year)
+with one partition per release year, keyed by (year, span, geoid). Loading
+a year replaces that state's rows in its partition only.
+
+Year-over-year deltas are computed for all geographies, columns and years
+at once: the geoids common to every year are aligned with searchsorted,
+stacked into a (years, geoids, columns) array, and differenced.
+
+  python timeseries.py load --acstable B01001 --years 2010 2011 2012 --state ca
+  python timeseries.py deltas --acstable B01001 --years 2010 2011 2012 --state ca > deltas.csv
+
+"""
+import argparse
+import csv
+import os
+import StringIO
+import sys
+
+import numpy
+
+import cityism.acs
+import cityism.config
+import cityism.instrument
+
+CACHEDIR = 'acs_cache'
+
+##### Columnar cache #####
+
+def cachefile(acstable, year, span, state, cachedir=CACHEDIR):
+    return os.path.join(cachedir, 'acs_%s_%04d_%d_%s.npz'%(acstable, year, span, state))
+
+def columns(acstable):
+    """Child column names of an ACS table."""
+    return [i.acstable for i in cityism.acs.ACSMeta.get(acstable).getchildren()]
+
+def parse(acstable, year, span, state):
+    """Parse one release from the ACS summary files. Return (geoids, values),
+    sorted by geoid."""
+    names = columns(acstable)
+    tracts = [i for i in cityism.acs.ACSMeta.get(acstable).read(year=year, span=span, state=state) if i.geoid]
+    geoids = numpy.array([i.geoid for i in tracts])
+    values = numpy.array([[numpy.nan if i.data.get(k) is None else i.data[k] for k in names] for i in tracts], dtype=numpy.float64)
+    values = values.reshape(len(tracts), len(names))
+    order = numpy.argsort(geoids, kind='mergesort')
+    return geoids[order], values[order]
+
+def read(acstable, year, span, state, cachedir=CACHEDIR, refresh=False):
+    """Return (geoids, values) for one release, from the cache if present."""
+    filename = cachefile(acstable, year, span, state, cachedir=cachedir)
+    with cityism.instrument.stage('timeseries.read', acstable=acstable, year=year, state=state) as s:
+        if os.path.exists(filename) and not refresh:
+            with numpy.load(filename) as f:
+                geoids, values = f['geoids'], f['values']
+        else:
+            geoids, values = parse(acstable, year, span, state)
+            if not os.path.exists(cachedir):
+                os.makedirs(cachedir)
+            numpy.savez_compressed(filename, geoids=geoids, values=values)
+        s.add(rows=len(geoids))
+    return geoids, values
+
+##### Deltas #####
+
+def align(releases):
+    """Align releases on the geoids present in all of them. Return (geoids,
+    array of shape (releases, geoids, columns))."""
+    common = releases[0][0]
+    for geoids, values in releases[1:]:
+        common = numpy.intersect1d(common, geoids)
+    stack = numpy.empty((len(releases), len(common), releases[0][1].shape[1]), dtype=numpy.float64)
+    for i, (geoids, values) in enumerate(releases):
+        # Each release is sorted by geoid, and contains every common geoid.
+        stack[i] = values[numpy.searchsorted(geoids, common)]
+    return common, stack
+
+def deltas(releases):
+    """Year-over-year changes between consecutive releases.
+
+    Return (geoids, change, pct), where change and pct have shape
+    (releases-1, geoids, columns). pct is NaN where the earlier value is 0
+    or missing."""
+    geoids, stack = align(releases)
+    change = numpy.diff(stack, axis=0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        pct = change / stack[:-1]
+    pct[~numpy.isfinite(pct)] = numpy.nan
+    return geoids, change, pct
+
+##### Partitioned storage #####
+
+def create_table(cursor, acstable, names):
+    """Create the partitioned acs_ts_<table> parent table."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS acs_ts_%(acstable)s (
+            year INTEGER NOT NULL,
+            span INTEGER NOT NULL,
+            geoid VARCHAR NOT NULL,
+            %(columns)s,
+            PRIMARY KEY (year, span, geoid)
+        ) PARTITION BY LIST (year);
+    """%{
+        'acstable': acstable,
+        'columns': ','.join(['%s INTEGER'%i for i in names])
+    })
+
+def create_partition(cursor, acstable, year):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS acs_ts_%(acstable)s_%(year)04d
+            PARTITION OF acs_ts_%(acstable)s FOR VALUES IN (%(year)d);
+    """%{'acstable': acstable, 'year': year})
+
+def copy_value(value):
+    """COPY text for an estimate; NaN is NULL."""
+    return cityism.config.copy_value(None if numpy.isnan(value) else '%d'%value)
+
+def copy_release(cursor, acstable, names, year, span, state, geoids, values):
+    """Replace one state's rows in a year partition with COPY."""
+    partition = 'acs_ts_%s_%04d'%(acstable, year)
+    statefp = cityism.acs.ACSFips.STATES_ANSI.get(state.upper())
+    if statefp:
+        cursor.execute("""DELETE FROM """+partition+""" WHERE span = %s AND geoid LIKE %s;""", (span, statefp+'%'))
+    else:
+        cursor.execute("""DELETE FROM """+partition+""" WHERE span = %s AND geoid = ANY(%s);""", (span, list(geoids)))
+    buf = StringIO.StringIO()
+    for geoid, row in zip(geoids, values):
+        buf.write('\t'.join(['%d'%year, '%d'%span, geoid] + [copy_value(i) for i in row]))
+        buf.write('\n')
+    buf.seek(0)
+    cursor.copy_from(buf, partition, columns=['year', 'span', 'geoid'] + [i.lower() for i in names])
+
+def load(acstable, years, span=5, state='ca', cachedir=CACHEDIR, refresh=False):
+    """Load several releases of a table into acs_ts_<table>. Each release
+    is committed on its own; a release that fails is reported and skipped.
+    Return the years loaded."""
+    names = columns(acstable)
+    loaded = []
+    with cityism.config.connect() as conn:
+        with conn.cursor() as cursor:
+            create_table(cursor, acstable, names)
+            conn.commit()
+            for year in years:
+                try:
+                    geoids, values = read(acstable, year, span, state, cachedir=cachedir, refresh=refresh)
+                    with cityism.instrument.stage('timeseries.copy', acstable=acstable, year=year, state=state) as s:
+                        create_partition(cursor, acstable, year)
+                        copy_release(cursor, acstable, names, year, span, state, geoids, values)
+                        s.add(rows=len(geoids))
+                    conn.commit()
+                except Exception, e:
+                    conn.rollback()
+                    print "Could not load %s %s %s!"%(acstable, year, state)
+                    print e
+                    continue
+                print "Loaded %s %s %s: %s rows"%(acstable, year, state, len(geoids))
+                loaded.append(year)
+    return loaded
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", help="load: cache and load releases; deltas: year-over-year changes as CSV", choices=['load', 'deltas'])
+    parser.add_argument("--acstable", help="ACS Table", required=True)
+    parser.add_argument("--years", help="Release years", nargs='+', type=int, required=True)
+    parser.add_argument("--span", help="Span", default=5, type=int)
+    parser.add_argument("--state", help="State", default='ca')
+    parser.add_argument("--cache", help="Cache directory", default=CACHEDIR)
+    parser.add_argument("--refresh", help="Re-parse summary files, ignoring the cache", action="store_true")
+    parser.add_argument("--pct", help="Write percent changes instead of counts", action="store_true")
+    args = parser.parse_args()
+
+    years = sorted(args.years)
+    if args.command == 'load':
+        load(args.acstable, years, span=args.span, state=args.state, cachedir=args.cache, refresh=args.refresh)
+        return
+
+    if len(years) < 2:
+        raise Exception("Need at least two years.")
+    releases = [read(args.acstable, year, args.span, args.state, cachedir=args.cache, refresh=args.refresh) for year in years]
+    geoids, change, pct = deltas(releases)
+    result = pct if args.pct else change
+    names = columns(args.acstable)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['geoid', 'year_from', 'year_to'] + names)
+    for i in range(len(years)-1):
+        for geoid, row in zip(geoids, result[i]):
+            writer.writerow([geoid, years[i], years[i+1]] + ['' if numpy.isnan(v) else '%0.4f'%v if args.pct else '%d'%v for v in row])
+
+if __name__ == "__main__":
+    main()
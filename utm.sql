@@ -1,3 +1,7 @@
+/* radial.py no longer uses these functions: annuli are computed client side
+(geodesic.py) and areas are measured on the geography type. They are kept
+for ad hoc queries. */
+
 /* Function: utmzone(geometry)
 DROP FUNCTION utmzone(geometry);
 Usage: SELECT ST_Transform(the_geom, utmzone(ST_Centroid(the_geom))) FROM sometable; */
@@ -0,0 +1,86 @@
+"""Encode geometries as (E)WKB.
+
+Only what the loaders need: points, and shapefile polygons and polylines
+as MultiPolygon and MultiLineString. Output is little-endian; with an SRID
+the EWKB SRID flag is set, which PostGIS accepts for both text (hex) and
+binary input.
+"""
+import struct
+
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTIPOINT = 4
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+
+SRID_FLAG = 0x20000000
+
+# pyshp shape types (including Z and M variants) to WKB types.
+SHAPETYPES = {
+    1: POINT, 11: POINT, 21: POINT,
+    3: MULTILINESTRING, 13: MULTILINESTRING, 23: MULTILINESTRING,
+    5: MULTIPOLYGON, 15: MULTIPOLYGON, 25: MULTIPOLYGON,
+    8: MULTIPOINT, 18: MULTIPOINT, 28: MULTIPOINT
+}
+
+def _header(wkbtype, srid=None):
+    if srid:
+        return struct.pack('<BII', 1, wkbtype | SRID_FLAG, srid)
+    return struct.pack('<BI', 1, wkbtype)
+
+def _points(points):
+    ret = [struct.pack('<I', len(points))]
+    ret += [struct.pack('<dd', p[0], p[1]) for p in points]
+    return ''.join(ret)
+
+def point(x, y, srid=None):
+    return _header(POINT, srid) + struct.pack('<dd', x, y)
+
+def linestring(points, srid=None):
+    return _header(LINESTRING, srid) + _points(points)
+
+def polygon(rings, srid=None):
+    """Polygon from a list of rings; the first is the exterior."""
+    return _header(POLYGON, srid) + struct.pack('<I', len(rings)) + ''.join(_points(i) for i in rings)
+
+def multi(wkbtype, parts, srid=None):
+    """Multi-geometry from a list of (non-EWKB) WKB members."""
+    return _header(wkbtype, srid) + struct.pack('<I', len(parts)) + ''.join(parts)
+
+def ring_area(points):
+    """Signed area of a ring; negative when clockwise."""
+    area = 0.0
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        area += x0 * y1 - x1 * y0
+    return area / 2.0
+
+def split_parts(shape):
+    """Split a shape's point list at its part offsets."""
+    bounds = list(shape.parts) + [len(shape.points)]
+    return [shape.points[bounds[i]:bounds[i+1]] for i in range(len(shape.parts))]
+
+def shape_polygons(shape):
+    """Group shapefile rings into polygons. Shapefile exterior rings are
+    clockwise and holes counter-clockwise; each hole is assigned to the
+    preceding exterior ring."""
+    polygons = []
+    for ring in split_parts(shape):
+        if ring_area(ring) <= 0 or not polygons:
+            polygons.append([ring])
+        else:
+            polygons[-1].append(ring)
+    return polygons
+
+def from_shape(shape, srid=None):
+    """Encode a pyshp shape as EWKB. Return None for null shapes."""
+    wkbtype = SHAPETYPES.get(shape.shapeType)
+    if wkbtype is None or not shape.points:
+        return None
+    if wkbtype == POINT:
+        return point(shape.points[0][0], shape.points[0][1], srid=srid)
+    if wkbtype == MULTIPOINT:
+        return multi(MULTIPOINT, [point(p[0], p[1]) for p in shape.points], srid=srid)
+    if wkbtype == MULTILINESTRING:
+        return multi(MULTILINESTRING, [linestring(i) for i in split_parts(shape)], srid=srid)
+    return multi(MULTIPOLYGON, [polygon(i) for i in shape_polygons(shape)], srid=srid)